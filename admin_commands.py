@@ -1,17 +1,22 @@
 import logging
 import asyncio
 import os
+import re
 from aiogram.dispatcher.filters import Filter
 from aiogram.dispatcher import FSMContext
 from aiogram import types
 import shutil
-from typing import Dict
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 from aiogram.dispatcher.handler import CancelHandler
 from aiogram.dispatcher.middlewares import BaseMiddleware
 from datetime import datetime
 
 import config
-from sync_system.sync_engine import UniversalSyncEngine
+from sync_system.sync_engine import UniversalSyncEngine, fetch_sheets_records
 from sync_system.sync_config import SYNC_CONFIG, SUPPORT_TABLES
 from imports import (
     ProjectImporter, UserImporter, OptionImporter,
@@ -22,19 +27,62 @@ from bookstack_integration import clear_template_cache
 from database import Bonus, Project, Purchase, ActiveBalance, PassiveBalance
 from templates import MessageTemplates
 from google_services import get_google_services
-from sqlalchemy import func
+from sqlalchemy import func, and_, or_, delete, lambda_stmt, literal_column, select
 from database import Payment, Notification, User
 from init import Session
 
 
 logger = logging.getLogger(__name__)
 
+# Каталог в file_path (getFile) -> тип медиа для отправки
+FILE_PATH_MEDIA_TYPES = {
+    'stickers': 'sticker',
+    'photos': 'photo',
+    'videos': 'video',
+    'documents': 'document',
+    'animations': 'animation',
+    'music': 'audio',
+    'voice': 'voice',
+    'video_notes': 'video_note',
+}
+
+# Массовые удаления без сверки identity map: удаленные строки в сессии не загружены
+NO_SYNC = {'synchronize_session': False}
+
+# Telegram ограничивает сообщение 4096 символами, оставляем запас под шаблон
+REPORT_CHUNK_SIZE = 4000
+
+# &check: каждый ID платежа - два параметра (IN и LIKE), у SQLite лимит 999 параметров на запрос
+PAYMENT_CHECK_CHUNK = 400
+
+EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+# Провайдер почты -> шаблон строки его статуса в &testmail
+PROVIDER_STATUS_TEMPLATES = {
+    'smtp': 'admin/testmail/status_smtp',
+    'mailgun': 'admin/testmail/status_mailgun',
+}
+
+PROVIDER_STATUS_LABELS = {True: '✅ OK', False: '❌ FAIL'}
+
+# Регистронезависимый поиск таблиц для &import
+_SUPPORT_TABLES_CI = {table.lower(): table for table in SUPPORT_TABLES}
+
+# Проверка на админа идет на каждое сообщение - держим множество, а не список
+_ADMINS = frozenset(config.ADMINS)
+
+
+def _refresh_admins() -> None:
+    """Перечитывает config.ADMINS после обновления конфигурации"""
+    global _ADMINS
+    _ADMINS = frozenset(config.ADMINS)
+
 
 class AdminFilter(Filter):
     key = 'is_admin'  # Обязательно нужен key для фильтра
 
     async def check(self, message: types.Message) -> bool:
-        return message.from_user.id in config.ADMINS
+        return message.from_user.id in _ADMINS
 
 
 class AdminCommandsMiddleware(BaseMiddleware):
@@ -43,24 +91,160 @@ class AdminCommandsMiddleware(BaseMiddleware):
         self.admin_commands_instance = admin_commands_instance
 
     async def on_process_message(self, message: types.Message, data: dict):
-        if message.from_user.id in config.ADMINS and message.text and message.text.startswith('&'):
+        # Сначала дешевая проверка префикса - большинство сообщений не команды
+        if not (message.text and message.text.startswith('&')):
+            return
+        if message.from_user.id not in _ADMINS:
+            return
 
-            state = data['state']
+        state = data['state']
+        # StateFilter уже прочитал состояние из хранилища - не ходим туда повторно
+        if 'raw_state' in data:
+            current_state = data['raw_state']
+        else:
             current_state = await state.get_state()
 
-            if current_state:
-                logger.info(f"Сброшено состояние {current_state} для администратора")
-                await state.finish()
+        if current_state:
+            logger.info(f"Сброшено состояние {current_state} для администратора")
+            await state.finish()
+
+        await self.admin_commands_instance.handle_admin_command(message, state, state_reset=True)
+
+        raise CancelHandler()
 
-            await self.admin_commands_instance.handle_admin_command(message, state)
 
-            raise CancelHandler()
+def _split_report(report: str, limit: int) -> List[str]:
+    """Разбивает отчет на части не длиннее limit
+
+    Части собираются из целых блоков таблиц (начинаются с "📋 "); слишком длинный
+    блок делится по строкам, слишком длинная строка - по limit символов.
+    """
+    pieces = []
+    for section in re.split(r'(?=📋 )', report):
+        if len(section) <= limit:
+            pieces.append(section)
+            continue
+        for line in section.splitlines(keepends=True):
+            pieces.extend(line[i:i + limit] for i in range(0, len(line), limit))
+
+    chunks = []
+    current = ''
+    for piece in pieces:
+        if current and len(current) + len(piece) > limit:
+            chunks.append(current)
+            current = ''
+        current += piece
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+def _testmail_status_templates(providers_status: Dict[str, bool], has_secure_domains: bool) -> List[str]:
+    """Заголовок, статусы провайдеров и блок защищенных доменов для отчетов &testmail"""
+    return (
+        ['admin/testmail/header']
+        + [PROVIDER_STATUS_TEMPLATES[name] for name in providers_status if name in PROVIDER_STATUS_TEMPLATES]
+        + ['admin/testmail/secure_domains' if has_secure_domains else 'admin/testmail/no_secure_domains']
+    )
+
+
+def _list_backups(backup_dir) -> list:
+    """Файлы бэкапов в каталоге, от старых к новым
+
+    Имена содержат метку времени (talentir_YYYYmmdd_HHMMSS.db), поэтому сортировка
+    по имени хронологическая и stat для каждого файла не нужен.
+    """
+    with os.scandir(backup_dir) as entries:
+        backups = [entry for entry in entries if entry.name.endswith('.db') and entry.is_file()]
+    backups.sort(key=lambda entry: entry.name)
+    return backups
+
+
+def _sqlite_backup(db_path: str, backup_path: str) -> None:
+    """Снимает копию БД через online backup API SQLite
+
+    В отличие от копирования файла, снимок консистентен даже при параллельной записи:
+    страницы переносятся порциями, и между ними писатели не блокируются.
+    """
+    source = sqlite3.connect(db_path)
+    try:
+        target = sqlite3.connect(backup_path)
+        try:
+            source.backup(target, pages=1024, sleep=0.001)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+
+def _fast_copy(src: str, dst: str) -> None:
+    """Копирует файл с метаданными, по возможности без прохода через userspace
+
+    На Linux сначала пробуем copy_file_range (на btrfs/XFS это reflink), при
+    ошибке - shutil.copyfile, который сам использует sendfile или буферный цикл.
+    """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    copied = False
+    if copy_file_range is not None:
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    sent = copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if sent == 0:
+                        break
+                    remaining -= sent
+                copied = remaining == 0
+        except OSError:
+            copied = False
+
+    if not copied:
+        shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+
+
+@dataclass(frozen=True)
+class AdminInfo:
+    """Отвязанный от сессии снимок админа для записей в балансах"""
+    userID: int
+    firstname: str
+    surname: Optional[str]
 
 
 class AdminCommands:
+    ADMIN_CACHE_TTL = 60  # секунд
+    PROVIDERS_STATUS_TTL = 30  # секунд
+
+    # Ключ листа Config -> статическая переменная GlobalVariables (для &upconfig)
+    _VARS_TO_UPDATE = {
+        'PURCHASE_BONUSES': 'purchase_bonuses',
+        'STRATEGY_COEFFICIENTS': 'strategy_coefficients',
+        'TRANSFER_BONUS': 'transfer_bonus',
+        'SOCIAL_LINKS': 'social_links',
+        'FAQ_URL': 'faq_url',
+        'REQUIRED_CHANNELS': 'required_channels',
+        'PROJECT_DOCUMENTS': 'project_documents'
+    }
+
     def __init__(self, dp, message_manager):
         self.dp = dp
         self.message_manager = message_manager
+        self._admin_cache: Dict[int, Tuple[float, Optional[AdminInfo]]] = {}
+        self._providers_status_cache: Dict[str, Tuple[float, bool]] = {}
+        self._providers_status_lock = asyncio.Lock()
+        self._commands = {
+            "import": self.handle_import,
+            "restore": self.handle_restore,
+            "object": self.handle_object,
+            "upconfig": self.handle_upconfig,
+            "upro": self.handle_upro,
+            "ut": self.handle_ut,
+            "addbalance": self.handle_addbalance,
+            "testmail": self.handle_testmail,
+            "broadcast": self.handle_broadcast,
+            "check": self.handle_check,
+            "legacy": self.handle_legacy,
+        }
         self.register_handlers()
 
     def register_handlers(self):
@@ -72,6 +256,64 @@ class AdminCommands:
             lambda msg: msg.text and msg.text.startswith('&'),
             state='*'
         )
+        self.dp.register_callback_query_handler(
+            self.handle_delpurchase_callback,
+            AdminFilter(),
+            lambda c: c.data and c.data.startswith('delpurchase:'),
+            state='*'
+        )
+
+    @asynccontextmanager
+    async def _combined_writes(self, **session_options):
+        """
+        Сессия, все записи которой фиксируются одним commit при выходе из блока.
+        При исключении изменения откатываются.
+        """
+        with Session(**session_options) as session:
+            try:
+                yield session
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
+    def _cached_providers_status(self, email_manager) -> Optional[Dict[str, bool]]:
+        """Статус провайдеров из кеша или None, если хоть один устарел"""
+        now = time.monotonic()
+        cache = self._providers_status_cache
+        if all(
+            name in cache and now - cache[name][0] < self.PROVIDERS_STATUS_TTL
+            for name in email_manager.providers
+        ):
+            return {name: cache[name][1] for name in email_manager.providers}
+        return None
+
+    async def _get_providers_status(self, email_manager) -> Dict[str, bool]:
+        """
+        Статус почтовых провайдеров с кешированием на PROVIDERS_STATUS_TTL.
+        Lock не дает параллельным &testmail проверять провайдеров одновременно.
+        """
+        async with self._providers_status_lock:
+            cached = self._cached_providers_status(email_manager)
+            if cached is not None:
+                return cached
+
+            status = await email_manager.get_providers_status()
+            checked_at = time.monotonic()
+            self._providers_status_cache = {name: (checked_at, ok) for name, ok in status.items()}
+            return status
+
+    def _get_admin(self, session, telegram_id: int) -> Optional[AdminInfo]:
+        """Возвращает данные админа по telegramID с кешированием на ADMIN_CACHE_TTL"""
+        now = time.monotonic()
+        cached = self._admin_cache.get(telegram_id)
+        if cached and now - cached[0] < self.ADMIN_CACHE_TTL:
+            return cached[1]
+
+        row = session.query(User.userID, User.firstname, User.surname).filter_by(telegramID=telegram_id).first()
+        admin = AdminInfo(*row) if row else None
+        self._admin_cache[telegram_id] = (now, admin)
+        return admin
 
     async def _add_balance_to_user(self, session, user_id: int, amount: float, reason: str, admin_user) -> tuple[
         bool, str]:
@@ -82,19 +324,23 @@ class AdminCommands:
             user_id: User ID to add balance to
             amount: Amount to add (can be negative)
             reason: Reason for balance change
-            admin_user: Admin user making the change
+            admin_user: Admin making the change (AdminInfo or User)
 
         Returns:
             (success: bool, message: str)
         """
         try:
-            # Get user
-            user = session.query(User).filter_by(userID=user_id).first()
+            # Get user (served from the identity map when already loaded)
+            user = session.get(User, user_id)
             if not user:
                 return False, f"User {user_id} not found"
 
-            # Update balance
-            user.balanceActive += amount
+            # Update balance atomically in SQL rather than read-modify-write in Python;
+            # the loaded user picks up the new value when commit expires it
+            session.query(User).filter_by(userID=user_id).update(
+                {User.balanceActive: User.balanceActive + amount},
+                synchronize_session=False
+            )
 
             # Create ActiveBalance record
             admin_name = admin_user.firstname if admin_user else "Unknown Admin"
@@ -192,7 +438,7 @@ class AdminCommands:
                     return
 
                 # CONFIRM MODE - Add balance
-                admin_user = session.query(User).filter_by(telegramID=message.from_user.id).first()
+                admin_user = self._get_admin(session, message.from_user.id)
 
                 success, result_msg = await self._add_balance_to_user(
                     session, user_id, amount, reason, admin_user
@@ -225,7 +471,7 @@ class AdminCommands:
         """Handler for &delpurchase command to safely delete purchase records"""
         try:
             # Parse command arguments
-            command_parts = message.text.strip().split()
+            command_parts = message.text.split()
 
             if len(command_parts) < 2:
                 await message.reply(
@@ -251,141 +497,225 @@ class AdminCommands:
 
             reply = await message.reply(f"🔄 {'Deleting' if confirm_mode else 'Analyzing'} purchase {purchase_id}...")
 
-            with Session() as session:
-                # First, get purchase details
-                purchase = session.query(Purchase).filter_by(purchaseID=purchase_id).first()
+            await self._process_delpurchase(reply, message.from_user.id, purchase_id, confirm_mode, refund_mode)
 
-                if not purchase:
-                    await reply.edit_text(f"❌ Purchase {purchase_id} not found")
-                    return
+        except Exception as e:
+            logger.error(f"Error in delpurchase: {e}", exc_info=True)
+            await message.reply(f"❌ Error: {str(e)}")
 
-                # Get user info
-                user = session.query(User).filter_by(userID=purchase.userID).first()
-                user_name = user.firstname if user else "Unknown"
+    async def _process_delpurchase(self, reply: types.Message, admin_id: int, purchase_id: int,
+                                   confirm_mode: bool, refund_mode: bool):
+        """Analyze or delete a purchase, reporting progress by editing the reply message"""
+        with Session() as session:
+            # Fetch only the columns the report needs, with the owner's name joined in;
+            # nothing here is modified through the ORM, so no instances are built
+            columns = [
+                Purchase.userID,
+                Purchase.projectName,
+                Purchase.projectID,
+                Purchase.packQty,
+                Purchase.packPrice,
+                Purchase.optionID,
+                Purchase.createdAt,
+                User.userID.label('ownerID'),
+                User.firstname.label('ownerName')
+            ]
+            if not confirm_mode:
+                # The analysis also needs related-record counts; correlated scalar
+                # subqueries fold them into the same SELECT, one round trip in total
+                columns += [
+                    select(func.count(Bonus.bonusID))
+                    .where(Bonus.purchaseID == Purchase.purchaseID)
+                    .correlate(Purchase).scalar_subquery().label('bonusesCount'),
+                    select(func.coalesce(func.sum(Bonus.bonusAmount), 0))
+                    .where(Bonus.purchaseID == Purchase.purchaseID)
+                    .correlate(Purchase).scalar_subquery().label('bonusesTotal'),
+                    select(func.count(ActiveBalance.paymentID))
+                    .where(ActiveBalance.purchaseID == Purchase.purchaseID)
+                    .correlate(Purchase).scalar_subquery().label('activeBalanceCount'),
+                ]
+
+            query = session.query(*columns).outerjoin(
+                User, User.userID == Purchase.userID
+            ).filter(Purchase.purchaseID == purchase_id)
+            if confirm_mode:
+                # Serialize concurrent deletions of the same purchase
+                query = query.with_for_update(of=Purchase)
+            purchase = query.first()
+
+            if not purchase:
+                await reply.edit_text(f"❌ Purchase {purchase_id} not found")
+                return
 
-                # Check for related records
-                related_bonuses = session.query(Bonus).filter_by(purchaseID=purchase_id).all()
-                related_active_balance = session.query(ActiveBalance).filter(
-                    ActiveBalance.reason.like(f'%purchase={purchase_id}%')
-                ).all()
+            # Get user info
+            user_name = purchase.ownerName if purchase.ownerID else "Unknown"
+
+            # If NOT confirm mode - show analysis and exit
+            if not confirm_mode:
+                bonuses_count = purchase.bonusesCount
+                total_bonuses = purchase.bonusesTotal
+                active_balance_count = purchase.activeBalanceCount
+
+                analysis_parts = [
+                    f"📊 <b>Purchase Analysis</b>\n\n",
+                    f"🆔 Purchase ID: {purchase_id}\n",
+                    f"👤 User: {user_name} (ID: {purchase.userID})\n",
+                    f"📦 Project: {purchase.projectName} (ID: {purchase.projectID})\n",
+                    f"🎯 Quantity: {purchase.packQty} shares\n",
+                    f"💰 Price: ${purchase.packPrice:.2f}\n",
+                    f"🔧 Option: {purchase.optionID}\n",
+                    f"📅 Date: {purchase.createdAt.isoformat(sep=' ', timespec='seconds')}\n\n",
+                    f"🔗 <b>Related Records:</b>\n",
+                    f"• Bonuses: {bonuses_count}\n",
+                    f"• Active Balance: {active_balance_count}\n\n",
+                ]
+
+                if bonuses_count:
+                    analysis_parts.append(f"💰 Total bonuses paid: ${total_bonuses:.2f}\n\n")
+
+                analysis_parts.append(
+                    "⚠️ This will permanently delete the purchase and ALL related records!\n\n"
+                    f"To delete: <code>&delpurchase {purchase_id} --confirm</code>\n"
+                    f"To delete + refund: <code>&delpurchase {purchase_id} --refund --confirm</code>"
+                )
+                analysis = "".join(analysis_parts)
 
-                # If NOT confirm mode - show analysis and exit
-                if not confirm_mode:
-                    analysis = (
-                        f"📊 <b>Purchase Analysis</b>\n\n"
-                        f"🆔 Purchase ID: {purchase_id}\n"
-                        f"👤 User: {user_name} (ID: {purchase.userID})\n"
-                        f"📦 Project: {purchase.projectName} (ID: {purchase.projectID})\n"
-                        f"🎯 Quantity: {purchase.packQty} shares\n"
-                        f"💰 Price: ${purchase.packPrice:.2f}\n"
-                        f"🔧 Option: {purchase.optionID}\n"
-                        f"📅 Date: {purchase.createdAt.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-                        f"🔗 <b>Related Records:</b>\n"
-                        f"• Bonuses: {len(related_bonuses)}\n"
-                        f"• Active Balance: {len(related_active_balance)}\n\n"
-                    )
+                keyboard = types.InlineKeyboardMarkup(row_width=1).add(
+                    types.InlineKeyboardButton("⚠️ Delete", callback_data=f"delpurchase:confirm:{purchase_id}"),
+                    types.InlineKeyboardButton("⚠️ Delete + refund", callback_data=f"delpurchase:refund:{purchase_id}"),
+                    types.InlineKeyboardButton("Cancel", callback_data="delpurchase:cancel")
+                )
 
-                    if related_bonuses:
-                        total_bonuses = sum(b.bonusAmount for b in related_bonuses)
-                        analysis += f"💰 Total bonuses paid: ${total_bonuses:.2f}\n\n"
+                await reply.edit_text(analysis, parse_mode='HTML', reply_markup=keyboard)
+                return
 
-                    analysis += (
-                        "⚠️ This will permanently delete the purchase and ALL related records!\n\n"
-                        f"To delete: <code>&delpurchase {purchase_id} --confirm</code>\n"
-                        f"To delete + refund: <code>&delpurchase {purchase_id} --refund --confirm</code>"
-                    )
+            # CONFIRM MODE - Create backup first
+            try:
+                await reply.edit_text(f"🔄 Creating backup before deletion...")
+                backup_path = await self._create_backup(category='manual')
+                logger.info(f"Backup created: {backup_path}")
+                await reply.edit_text(f"🔄 Backup created. Deleting purchase {purchase_id}...")
+            except Exception as e:
+                error_msg = f"❌ Failed to create backup: {str(e)}\nDeletion cancelled for safety."
+                logger.error(f"Backup failed: {e}", exc_info=True)
+                await reply.edit_text(error_msg)
+                return
 
-                    await reply.edit_text(analysis, parse_mode='HTML')
-                    return
+            try:
+                # 1. Delete related bonuses
+                # Aggregate in the DB instead of loading every Bonus row
+                bonuses_count, total_bonuses_removed = session.execute(lambda_stmt(
+                    lambda: select(
+                        func.count(Bonus.bonusID),
+                        func.coalesce(func.sum(Bonus.bonusAmount), 0)
+                    ).where(Bonus.purchaseID == purchase_id)
+                )).one()
+
+                # The FK is declared ON DELETE CASCADE, but SQLite only enforces it
+                # with PRAGMA foreign_keys=ON, so bonuses are still deleted explicitly
+                session.execute(
+                    delete(Bonus).where(Bonus.purchaseID == purchase_id),
+                    execution_options=NO_SYNC
+                )
 
-                # CONFIRM MODE - Create backup first
-                try:
-                    await reply.edit_text(f"🔄 Creating backup before deletion...")
-                    backup_path = await self._create_backup(category='manual')
-                    logger.info(f"Backup created: {backup_path}")
-                    await reply.edit_text(f"🔄 Backup created. Deleting purchase {purchase_id}...")
-                except Exception as e:
-                    error_msg = f"❌ Failed to create backup: {str(e)}\nDeletion cancelled for safety."
-                    logger.error(f"Backup failed: {e}", exc_info=True)
-                    await reply.edit_text(error_msg)
+                # 2. Delete related active balance records
+                # A single set-based DELETE; its rowcount is all the report needs
+                active_balance_deleted = session.execute(
+                    delete(ActiveBalance).where(ActiveBalance.purchaseID == purchase_id),
+                    execution_options=NO_SYNC
+                ).rowcount
+
+                # 3. Delete the purchase record
+                purchase_deleted = session.execute(
+                    delete(Purchase).where(Purchase.purchaseID == purchase_id),
+                    execution_options=NO_SYNC
+                ).rowcount
+                if not purchase_deleted:
+                    # Another confirmation got here first (e.g. a double-tapped button);
+                    # without this check the refund below would be paid twice
+                    session.rollback()
+                    await reply.edit_text(f"❌ Purchase {purchase_id} was already deleted")
                     return
 
-                try:
-                    # 1. Delete related bonuses
-                    bonuses = session.query(Bonus).filter_by(purchaseID=purchase_id).all()
-                    total_bonuses_removed = sum(b.bonusAmount for b in bonuses)
-
-                    session.query(Bonus).filter_by(purchaseID=purchase_id).delete()
-
-                    # 2. Delete related active balance records
-                    active_balance_records = session.query(ActiveBalance).filter(
-                        ActiveBalance.reason.like(f'%purchase={purchase_id}%')
-                    ).all()
-
-                    session.query(ActiveBalance).filter(
-                        ActiveBalance.reason.like(f'%purchase={purchase_id}%')
-                    ).delete(synchronize_session=False)
-
-                    # 3. Delete the purchase record
-                    session.query(Purchase).filter_by(purchaseID=purchase_id).delete()
-
-                    # 4. If refund mode - add balance back to user
-                    refund_amount = 0
-                    if refund_mode:
-                        refund_amount = purchase.packPrice
-                        admin_user = session.query(User).filter_by(telegramID=message.from_user.id).first()
-
-                        success, refund_msg = await self._add_balance_to_user(
-                            session,
-                            purchase.userID,
-                            refund_amount,
-                            f'refund_purchase={purchase_id}',
-                            admin_user
-                        )
+                # 4. If refund mode - add balance back to user
+                refund_amount = 0
+                if refund_mode:
+                    refund_amount = purchase.packPrice
+                    admin_user = self._get_admin(session, admin_id)
+
+                    success, refund_msg = await self._add_balance_to_user(
+                        session,
+                        purchase.userID,
+                        refund_amount,
+                        f'refund_purchase={purchase_id}',
+                        admin_user
+                    )
 
-                        if not success:
-                            session.rollback()
-                            await reply.edit_text(f"❌ Refund failed: {refund_msg}\nTransaction rolled back.")
-                            return
+                    if not success:
+                        session.rollback()
+                        await reply.edit_text(f"❌ Refund failed: {refund_msg}\nTransaction rolled back.")
+                        return
 
-                    # Commit transaction
-                    session.commit()
+                # Commit transaction
+                session.commit()
 
-                    # Success message
-                    user_info = f"{user.firstname} (ID: {user.userID})" if user else f"Unknown (ID: {purchase.userID})"
+                # Success message
+                user_info = f"{user_name} (ID: {purchase.userID})"
 
-                    success_msg = (
-                        f"✅ <b>Purchase {purchase_id} deleted successfully!</b>\n\n"
-                        f"📊 <b>Deleted:</b>\n"
-                        f"• Purchase: {purchase.packQty} shares of {purchase.projectName}\n"
-                        f"• Bonuses: {len(bonuses)} records (${total_bonuses_removed:.2f})\n"
-                        f"• Balance records: {len(active_balance_records)}\n\n"
-                        f"👤 User: {user_info}\n"
-                    )
+                success_parts = [
+                    f"✅ <b>Purchase {purchase_id} deleted successfully!</b>\n\n",
+                    f"📊 <b>Deleted:</b>\n",
+                    f"• Purchase: {purchase.packQty} shares of {purchase.projectName}\n",
+                    f"• Bonuses: {bonuses_count} records (${total_bonuses_removed:.2f})\n",
+                    f"• Balance records: {active_balance_deleted}\n\n",
+                    f"👤 User: {user_info}\n",
+                ]
 
-                    if refund_mode:
-                        success_msg += f"💰 Refunded: ${refund_amount:.2f}\n"
+                if refund_mode:
+                    success_parts.append(f"💰 Refunded: ${refund_amount:.2f}\n")
 
-                    success_msg += f"💾 Backup: {os.path.basename(backup_path)}"
+                success_parts.append(f"💾 Backup: {os.path.basename(backup_path)}")
+                success_msg = "".join(success_parts)
 
-                    await reply.edit_text(success_msg, parse_mode='HTML')
+                await reply.edit_text(success_msg, parse_mode='HTML')
 
-                    logger.info(
-                        f"Purchase {purchase_id} deleted by admin {message.from_user.id}{' with refund' if refund_mode else ''}")
+                logger.info(
+                    f"Purchase {purchase_id} deleted by admin {admin_id}{' with refund' if refund_mode else ''}")
 
-                except Exception as e:
-                    session.rollback()
-                    logger.error(f"Error during deletion transaction: {e}", exc_info=True)
-                    await reply.edit_text(
-                        f"❌ Error during deletion: {str(e)}\n\n"
-                        f"Transaction rolled back. Database unchanged.\n"
-                        f"Backup available: {os.path.basename(backup_path)}"
-                    )
-                    raise
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Error during deletion transaction: {e}", exc_info=True)
+                await reply.edit_text(
+                    f"❌ Error during deletion: {str(e)}\n\n"
+                    f"Transaction rolled back. Database unchanged.\n"
+                    f"Backup available: {os.path.basename(backup_path)}"
+                )
+                raise
+
+    async def handle_delpurchase_callback(self, callback_query: types.CallbackQuery):
+        """Handler for the inline confirm/cancel buttons under a delpurchase analysis"""
+        _, action, *args = callback_query.data.split(':')
+        await callback_query.answer()
+
+        try:
+            # Drop the buttons so the same deletion can't be triggered twice
+            await callback_query.message.edit_reply_markup(reply_markup=None)
 
+            if action == 'cancel':
+                await callback_query.message.reply("❎ Deletion cancelled")
+                return
+
+            purchase_id = int(args[0])
+            await self._process_delpurchase(
+                callback_query.message,
+                callback_query.from_user.id,
+                purchase_id,
+                confirm_mode=True,
+                refund_mode=action == 'refund'
+            )
         except Exception as e:
             logger.error(f"Error in delpurchase: {e}", exc_info=True)
-            await message.reply(f"❌ Error: {str(e)}")
+            await callback_query.message.reply(f"❌ Error: {str(e)}")
 
     async def _import_sheet(self, message: types.Message, importer_class, sheet_name: str):
         """Общий метод для импорта данных"""
@@ -426,15 +756,15 @@ class AdminCommands:
 
     async def handle_restore(self, message: types.Message):
         """&restore [backup_file] - восстановление из бэкапа"""
-        args = message.text.split()[1:] if len(message.text.split()) > 1 else []
+        args = message.text.split()[1:]
 
         if not args:
             # Показываем список доступных бэкапов
             backup_dir = "/opt/talentir/backups/import"
             if os.path.exists(backup_dir):
-                backups = sorted([f for f in os.listdir(backup_dir) if f.endswith('.db')])[-5:]
+                backups = _list_backups(backup_dir)[-5:]
                 if backups:
-                    backup_list = "\n".join(backups)
+                    backup_list = "\n".join(entry.name for entry in backups)
                     await message.reply(
                         f"📁 Доступные бэкапы:\n{backup_list}\n\n"
                         "Использование: &restore [имя_файла]"
@@ -455,7 +785,7 @@ class AdminCommands:
             current_backup = await self._create_backup()
 
             # Восстанавливаем из бэкапа
-            shutil.copy2(backup_path, "/opt/talentir/bot/data/talentir.db")
+            await asyncio.to_thread(_fast_copy, backup_path, "/opt/talentir/bot/data/talentir.db")
 
             await message.reply(
                 f"✅ БД восстановлена из бэкапа: {backup_name}\n"
@@ -475,7 +805,7 @@ class AdminCommands:
                 return
 
         # Парсим параметры команды
-        command_parts = message.text.strip().split()
+        command_parts = message.text.split()
         mode = 'dry'  # По умолчанию
         tables_to_import = SUPPORT_TABLES.copy()
 
@@ -502,15 +832,9 @@ class AdminCommands:
 
                 valid_tables = []
                 for table in requested_tables:
-                    # Проверяем с учетом регистра (Users, Payments и т.д.)
-                    found = False
-                    for supported_table in SUPPORT_TABLES:
-                        if table.lower() == supported_table.lower():
-                            valid_tables.append(supported_table)
-                            found = True
-                            break
-
-                    if not found:
+                    # Приводим к каноничному имени (Users, Payments и т.д.)
+                    canonical = _SUPPORT_TABLES_CI.get(table.lower())
+                    if canonical is None:
                         await self.message_manager.send_template(
                             user=admin_user,
                             template_key='admin/import/unknown_table',
@@ -518,6 +842,7 @@ class AdminCommands:
                             update=message
                         )
                         return
+                    valid_tables.append(canonical)
 
                 if valid_tables:
                     tables_to_import = valid_tables
@@ -558,6 +883,15 @@ class AdminCommands:
             'errors': 0
         }
 
+        # Все листы читаем одним запросом в отдельном потоке, чтобы бот не замирал
+        # на время сетевого запроса; при ошибке каждый движок читает свой лист сам
+        sheet_names = {table: SYNC_CONFIG[table]['sheet_name'] for table in tables_to_import}
+        try:
+            prefetched = await asyncio.to_thread(fetch_sheets_records, list(sheet_names.values()))
+        except Exception as e:
+            logger.warning(f"Batch sheet fetch failed, falling back to per-table reads: {e}")
+            prefetched = {}
+
         try:
             with Session() as sync_session:
                 for table_name in tables_to_import:
@@ -566,7 +900,8 @@ class AdminCommands:
                         engine = UniversalSyncEngine(table_name)
                         results = engine.import_from_sheets(
                             sync_session,
-                            dry_run=(mode == 'dry')
+                            dry_run=(mode == 'dry'),
+                            raw_records=prefetched.get(sheet_names[table_name])
                         )
 
                         all_results[table_name] = results
@@ -609,7 +944,7 @@ class AdminCommands:
         )
 
         # Отправляем финальный отчет
-        if len(report) > 4000:
+        if len(report) > REPORT_CHUNK_SIZE:
             # Краткий отчет
             icon = '✅' if total_stats['errors'] == 0 else '⚠️'
 
@@ -627,23 +962,16 @@ class AdminCommands:
                 update=message
             )
 
-            # Детальные отчеты по таблицам с ошибками как отдельные сообщения
-            for table_name, results in all_results.items():
-                if results.get('errors') or results.get('changes'):
-                    table_report = await self._format_table_report(
-                        table_name,
-                        results,
-                        mode,
-                        admin_user.lang
-                    )
-
-                    # Отправляем через message_manager с raw шаблоном
-                    await self.message_manager.send_template(
-                        user=admin_user,
-                        template_key='admin/sync/table_details_raw',
-                        variables={'content': table_report},
-                        update=message
-                    )
+            # Уже собранный детальный отчет отправляем частями по границам таблиц.
+            # Части - последовательные куски одного отчета в один чат, поэтому
+            # строго по порядку (и без всплеска сверх ~1 сообщения/сек на чат)
+            for chunk in _split_report(report, REPORT_CHUNK_SIZE):
+                await self.message_manager.send_template(
+                    user=admin_user,
+                    template_key='admin/sync/table_details_raw',
+                    variables={'content': chunk},
+                    update=message
+                )
         else:
             # Отправляем полный отчет
             await self.message_manager.send_template(
@@ -656,28 +984,36 @@ class AdminCommands:
     async def _format_detailed_import_report(self, results: Dict, mode: str, backup_path: str, lang: str) -> str:
         """Форматирует детальный отчет об импорте с использованием шаблонов"""
 
+        # Шаблоны независимы друг от друга: первым проходом собираем запросы
+        # и места вставки, затем получаем все тексты одним gather
+        needed = []
+        parts = []
+
+        def add_template(key: str, variables: dict, prefix: str = "", suffix: str = "") -> int:
+            needed.append((key, variables))
+            slot = len(needed) - 1
+            parts.append((prefix, slot, suffix))
+            return slot
+
         # Заголовок
         header_key = 'admin/sync/report_header_check' if mode == 'dry' else 'admin/sync/report_header_import'
-        header, _ = await MessageTemplates.get_raw_template(header_key, {}, lang)
+        add_template(header_key, {})
+        parts.extend(["\n", "=" * 30, "\n\n"])
 
-        report = header + "\n" + "=" * 30 + "\n\n"
+        # Тексты действий не зависят от изменения - запрашиваем каждый один раз на отчет
+        action_slots = {}
 
         # По каждой таблице
         for table_name, result in results.items():
             # Заголовок таблицы
-            report += f"📋 {table_name}:\n"
+            parts.append(f"📋 {table_name}:\n")
 
             if 'error' in result:
                 # Критическая ошибка таблицы
-                error_text, _ = await MessageTemplates.get_raw_template(
-                    'admin/sync/table_critical_error',
-                    {'error': result['error']},
-                    lang
-                )
-                report += f"  {error_text}\n\n"
+                add_template('admin/sync/table_critical_error', {'error': result['error']}, "  ", "\n\n")
             else:
                 # Статистика
-                stats_text, _ = await MessageTemplates.get_raw_template(
+                add_template(
                     'admin/sync/table_stats',
                     {
                         'total': result.get('total', 0),
@@ -685,73 +1021,61 @@ class AdminCommands:
                         'added': result.get('added', 0),
                         'skipped': result.get('skipped', 0)
                     },
-                    lang
+                    suffix="\n"
                 )
-                report += stats_text + "\n"
 
                 # Предупреждения о балансах
                 warnings = result.get('warnings', [])
                 if warnings:
-                    warnings_header, _ = await MessageTemplates.get_raw_template(
-                        'admin/sync/warnings_header',
-                        {'count': len(warnings)},
-                        lang
-                    )
-                    report += f"  {warnings_header}\n"
+                    add_template('admin/sync/warnings_header', {'count': len(warnings)}, "  ", "\n")
 
                     for warn in warnings[:5]:  # Первые 5 предупреждений
-                        report += f"    • Строка {warn.get('row', '?')}: {warn.get('warning', 'Balance mismatch')}\n"
+                        parts.append(f"    • Строка {warn.get('row', '?')}: {warn.get('warning', 'Balance mismatch')}\n")
 
                 # Ошибки
                 errors = result.get('errors', [])
                 if errors:
-                    errors_header, _ = await MessageTemplates.get_raw_template(
-                        'admin/sync/errors_header',
-                        {'count': len(errors)},
-                        lang
-                    )
-                    report += f"  {errors_header}\n"
+                    add_template('admin/sync/errors_header', {'count': len(errors)}, "  ", "\n")
 
                     for err in errors[:5]:  # Первые 5 ошибок
-                        report += f"    • Строка {err.get('row', '?')}: {err.get('error', 'Unknown error')}\n"
+                        parts.append(f"    • Строка {err.get('row', '?')}: {err.get('error', 'Unknown error')}\n")
 
                 # Изменения (только первые 5)
                 changes = result.get('changes', [])
                 if changes and mode == 'dry':
-                    changes_header, _ = await MessageTemplates.get_raw_template(
-                        'admin/sync/changes_header',
-                        {'count': min(5, len(changes))},
-                        lang
-                    )
-                    report += f"  {changes_header}\n"
+                    add_template('admin/sync/changes_header', {'count': min(5, len(changes))}, "  ", "\n")
 
                     for change in changes[:5]:
-                        action_text, _ = await MessageTemplates.get_raw_template(
-                            'admin/sync/change_action_update' if change.get(
-                                'action') == 'update' else 'admin/sync/change_action_add',
-                            {},
-                            lang
-                        )
-                        report += f"    • ID {change.get('id', '?')}: {action_text}\n"
+                        action_key = 'admin/sync/change_action_update' if change.get(
+                            'action') == 'update' else 'admin/sync/change_action_add'
+                        prefix = f"    • ID {change.get('id', '?')}: "
+                        if action_key in action_slots:
+                            parts.append((prefix, action_slots[action_key], "\n"))
+                        else:
+                            action_slots[action_key] = add_template(action_key, {}, prefix, "\n")
 
                         if change.get('action') == 'update':
                             for field_change in change.get('fields', []):
                                 field = field_change.get('field')
                                 old = field_change.get('old', '')
                                 new = field_change.get('new', '')
-                                report += f"      {field}: {old} → {new}\n"
+                                parts.append(f"      {field}: {old} → {new}\n")
 
-            report += "\n"
+            parts.append("\n")
 
         if backup_path:
-            backup_text, _ = await MessageTemplates.get_raw_template(
-                'admin/sync/backup_created',
-                {'path': backup_path},
-                lang
-            )
-            report += backup_text
+            add_template('admin/sync/backup_created', {'path': backup_path})
 
-        return report
+        templates = await asyncio.gather(*[
+            MessageTemplates.get_raw_template(key, variables, lang)
+            for key, variables in needed
+        ])
+        texts = [text for text, _ in templates]
+
+        return "".join(
+            part if isinstance(part, str) else f"{part[0]}{texts[part[1]]}{part[2]}"
+            for part in parts
+        )
 
     async def _create_backup(self, category: str = 'import') -> str:
         """Создает бэкап БД
@@ -775,16 +1099,20 @@ class AdminCommands:
         if not os.path.exists(db_path):
             raise FileNotFoundError(f"Database not found: {db_path}")
 
-        # Копируем БД
+        # Копируем БД в отдельном потоке, чтобы не блокировать event loop
         backup_filename = f"talentir_{timestamp}.db"
         backup_path = os.path.join(backup_dir, backup_filename)
-        shutil.copy2(db_path, backup_path)
+        try:
+            await asyncio.to_thread(_sqlite_backup, db_path, backup_path)
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite backup API failed, falling back to file copy: {e}")
+            await asyncio.to_thread(_fast_copy, db_path, backup_path)
 
         # Удаляем старые бэкапы (оставляем последние 20)
-        backups = sorted([f for f in os.listdir(backup_dir) if f.endswith('.db')])
+        backups = _list_backups(backup_dir)
         if len(backups) > 20:
             for old_backup in backups[:-20]:
-                os.remove(os.path.join(backup_dir, old_backup))
+                os.remove(old_backup.path)
 
         return backup_path
 
@@ -792,7 +1120,7 @@ class AdminCommands:
         """Отправляет медиа-объект по его file_id"""
         try:
             # Парсим команду
-            parts = message.text.strip().split(maxsplit=1)
+            parts = message.text.split(maxsplit=1)
 
             if len(parts) != 2:
                 await message.reply(
@@ -821,7 +1149,20 @@ class AdminCommands:
                 ('video_note', lambda: message.reply_video_note(video_note=file_id))
             ]
 
+            # Тип определяем одним запросом getFile по каталогу в file_path и пробуем его первым;
+            # перебор остается запасным вариантом (getFile не работает для файлов больше 20 МБ)
+            try:
+                telegram_file = await message.bot.get_file(file_id)
+                probed_type = FILE_PATH_MEDIA_TYPES.get((telegram_file.file_path or '').split('/', 1)[0])
+            except Exception as e:
+                logger.info(f"getFile probe failed for {file_id}: {e}")
+                probed_type = None
+
+            if probed_type:
+                send_attempts.sort(key=lambda attempt: attempt[0] != probed_type)
+
             errors = []
+            seen_errors = set()
 
             for media_type, send_func in send_attempts:
                 try:
@@ -833,7 +1174,8 @@ class AdminCommands:
                 except Exception as e:
                     error_text = str(e)
                     # Сохраняем только уникальные ошибки
-                    if not any(error_text in err for err in errors):
+                    if error_text not in seen_errors:
+                        seen_errors.add(error_text)
                         errors.append(f"{media_type}: {error_text}")
                     continue
 
@@ -869,24 +1211,15 @@ class AdminCommands:
 
             # Обновляем переменные в модуле config
             ConfigImporter.update_config_module(config_dict)
+            _refresh_admins()
+            self._admin_cache.clear()
 
             # Обновляем переменные в GlobalVariables
             from variables import GlobalVariables
 
-            variables_to_update = {
-                'PURCHASE_BONUSES': 'purchase_bonuses',
-                'STRATEGY_COEFFICIENTS': 'strategy_coefficients',
-                'TRANSFER_BONUS': 'transfer_bonus',
-                'SOCIAL_LINKS': 'social_links',
-                'FAQ_URL': 'faq_url',
-                'REQUIRED_CHANNELS': 'required_channels',
-                'PROJECT_DOCUMENTS': 'project_documents'
-            }
-
             global_vars = GlobalVariables()
-            for config_name, var_name in variables_to_update.items():
-                if config_name in config_dict:
-                    global_vars.set_static_variable(var_name, config_dict[config_name])
+            for config_name in self._VARS_TO_UPDATE.keys() & config_dict.keys():
+                global_vars.set_static_variable(self._VARS_TO_UPDATE[config_name], config_dict[config_name])
 
             # Reload secure domains in EmailManager after config update
             try:
@@ -950,8 +1283,7 @@ class AdminCommands:
 
             # Validate custom email if provided
             if custom_email:
-                import re
-                if not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', custom_email):
+                if not EMAIL_RE.match(custom_email):
                     await self.message_manager.send_template(
                         user=admin_user,
                         template_key='admin/testmail/invalid_email',
@@ -973,88 +1305,68 @@ class AdminCommands:
                 )
                 return
 
-            # Test all providers
-            await self.message_manager.send_template(
-                user=admin_user,
-                template_key='admin/testmail/checking',
-                update=reply,
-                edit=True
-            )
+            # Test all providers; the "checking" edit is only worth a round trip
+            # when there is an actual probe to wait for
+            if self._cached_providers_status(email_manager) is None:
+                await self.message_manager.send_template(
+                    user=admin_user,
+                    template_key='admin/testmail/checking',
+                    update=reply,
+                    edit=True
+                )
 
-            providers_status = await email_manager.get_providers_status()
+            providers_status = await self._get_providers_status(email_manager)
+
+            # Общие переменные для всех сообщений о статусе
+            status = {name: PROVIDER_STATUS_LABELS[is_ok] for name, is_ok in providers_status.items()}
+            base_vars = {
+                'smtp_host': config.SMTP_HOST,
+                'smtp_port': config.SMTP_PORT,
+                'smtp_status': status.get('smtp', PROVIDER_STATUS_LABELS[False]),
+                'mailgun_domain': config.MAILGUN_DOMAIN,
+                'mailgun_region': config.MAILGUN_REGION,
+                'mailgun_status': status.get('mailgun', PROVIDER_STATUS_LABELS[False]),
+                'domains': email_manager.secure_domains_joined
+            }
 
             # Build status report using modular templates
-            template_keys = ['admin/testmail/header']
-            working_providers = []
-
-            for provider_name, is_working in providers_status.items():
-                if provider_name == 'smtp':
-                    template_keys.append('admin/testmail/status_smtp')
-                elif provider_name == 'mailgun':
-                    template_keys.append('admin/testmail/status_mailgun')
+            status_templates = _testmail_status_templates(providers_status, bool(email_manager.secure_domains))
+            template_keys = list(status_templates)
+            working_providers = [name for name, is_working in providers_status.items() if is_working]
 
-                if is_working:
-                    working_providers.append(provider_name)
+            # Determine target email (admin_user was loaded above and keeps its attributes)
+            if custom_email:
+                target_email = custom_email
+                # Если админ тестирует свой собственный email - используем его имя
+                if admin_user and admin_user.email == custom_email:
+                    firstname = admin_user.firstname
+                else:
+                    firstname = "Test User"
 
-            # Add secure domains info
-            if email_manager.secure_domains:
-                template_keys.append('admin/testmail/secure_domains')
             else:
-                template_keys.append('admin/testmail/no_secure_domains')
-
-            # Determine target email
-            with Session() as session:
-                admin_user_db = session.query(User).filter_by(telegramID=message.from_user.id).first()
-
-                if custom_email:
-                    target_email = custom_email
-                    # Если админ тестирует свой собственный email - используем его имя
-                    if admin_user_db and admin_user_db.email == custom_email:
-                        firstname = admin_user_db.firstname
-                    else:
-                        firstname = "Test User"
-
-                else:
-                    user = session.query(User).filter_by(telegramID=message.from_user.id).first()
-                    if not user or not user.email:
-                        template_keys.append('admin/testmail/no_user_email')
+                if not admin_user or not admin_user.email:
+                    template_keys.append('admin/testmail/no_user_email')
 
-                        await self.message_manager.send_template(
-                            user=admin_user,
-                            template_key=template_keys,
-                            variables={
-                                'smtp_host': config.SMTP_HOST,
-                                'smtp_port': config.SMTP_PORT,
-                                'smtp_status': '✅ OK' if providers_status.get('smtp', False) else '❌ FAIL',
-                                'mailgun_domain': config.MAILGUN_DOMAIN,
-                                'mailgun_region': config.MAILGUN_REGION,
-                                'mailgun_status': '✅ OK' if providers_status.get('mailgun', False) else '❌ FAIL',
-                                'domains': ', '.join(email_manager.secure_domains)
-                            },
-                            update=reply,
-                            edit=True
-                        )
-                        return
-                    target_email = user.email
-                    firstname = user.firstname
+                    await self.message_manager.send_template(
+                        user=admin_user,
+                        template_key=template_keys,
+                        variables=base_vars,
+                        update=reply,
+                        edit=True
+                    )
+                    return
+                target_email = admin_user.email
+                firstname = admin_user.firstname
 
             # Determine which provider will be used
+            provider_order = None
             if forced_provider:
                 if forced_provider not in working_providers:
                     template_keys.append('admin/testmail/provider_not_working')
                     await self.message_manager.send_template(
                         user=admin_user,
                         template_key=template_keys,
-                        variables={
-                            'smtp_host': config.SMTP_HOST,
-                            'smtp_port': config.SMTP_PORT,
-                            'smtp_status': '✅ OK' if providers_status.get('smtp', False) else '❌ FAIL',
-                            'mailgun_domain': config.MAILGUN_DOMAIN,
-                            'mailgun_region': config.MAILGUN_REGION,
-                            'mailgun_status': '✅ OK' if providers_status.get('mailgun', False) else '❌ FAIL',
-                            'domains': ', '.join(email_manager.secure_domains) if email_manager.secure_domains else '',
-                            'provider': forced_provider.upper()
-                        },
+                        variables={**base_vars, 'provider': forced_provider.upper()},
                         update=reply,
                         edit=True
                     )
@@ -1079,92 +1391,67 @@ class AdminCommands:
             # Add sending status
             template_keys.append('admin/testmail/sending')
 
-            # Send status message
-            await self.message_manager.send_template(
-                user=admin_user,
-                template_key=template_keys,
-                variables={
-                    'smtp_host': config.SMTP_HOST,
-                    'smtp_port': config.SMTP_PORT,
-                    'smtp_status': '✅ OK' if providers_status.get('smtp', False) else '❌ FAIL',
-                    'mailgun_domain': config.MAILGUN_DOMAIN,
-                    'mailgun_region': config.MAILGUN_REGION,
-                    'mailgun_status': '✅ OK' if providers_status.get('mailgun', False) else '❌ FAIL',
-                    'domains': ', '.join(email_manager.secure_domains) if email_manager.secure_domains else '',
-                    'target_email': target_email,
-                    'provider': selected_provider.upper(),
-                    'domain': email_manager._get_email_domain(target_email)
-                },
-                update=reply,
-                edit=True
-            )
-
-            # Get email body template
-            email_subject, _ = await MessageTemplates.get_raw_template(
-                'admin/testmail/email_subject',
-                {'provider': selected_provider.upper()},
-                lang=admin_lang
-            )
+            async def send_test_email() -> bool:
+                # Get email subject and body templates concurrently
+                (email_subject, _), (email_body, _) = await asyncio.gather(
+                    MessageTemplates.get_raw_template(
+                        'admin/testmail/email_subject',
+                        {'provider': selected_provider.upper()},
+                        lang=admin_lang
+                    ),
+                    MessageTemplates.get_raw_template(
+                        'admin/testmail/email_body',
+                        {
+                            'firstname': firstname,
+                            'target_email': target_email,
+                            'provider': selected_provider.upper(),
+                            'time': datetime.utcnow().isoformat(sep=' ', timespec='seconds')
+                        },
+                        lang=admin_lang
+                    )
+                )
 
-            email_body, _ = await MessageTemplates.get_raw_template(
-                'admin/testmail/email_body',
-                {
-                    'firstname': firstname,
-                    'target_email': target_email,
-                    'provider': selected_provider.upper(),
-                    'time': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-                },
-                lang=admin_lang
-            )
+                # Send test email
+                provider = email_manager.providers[selected_provider]
+                return await provider.send_email(
+                    to=target_email,
+                    subject=email_subject,
+                    html_body=email_body,
+                    text_body=None
+                )
 
-            # Send test email
-            provider = email_manager.providers[selected_provider]
-            success = await provider.send_email(
-                to=target_email,
-                subject=email_subject,
-                html_body=email_body,
-                text_body=None
+            # Status message edit and the email itself are independent - run them together
+            _, success = await asyncio.gather(
+                self.message_manager.send_template(
+                    user=admin_user,
+                    template_key=template_keys,
+                    variables={
+                        **base_vars,
+                        'target_email': target_email,
+                        'provider': selected_provider.upper(),
+                        'domain': email_manager._get_email_domain(target_email)
+                    },
+                    update=reply,
+                    edit=True
+                ),
+                send_test_email()
             )
 
             # Build final status message
             if success:
-                final_templates = ['admin/testmail/header']
-
-                # Add provider statuses
-                for provider_name in providers_status.keys():
-                    if provider_name == 'smtp':
-                        final_templates.append('admin/testmail/status_smtp')
-                    elif provider_name == 'mailgun':
-                        final_templates.append('admin/testmail/status_mailgun')
-
-                # Add secure domains
-                if email_manager.secure_domains:
-                    final_templates.append('admin/testmail/secure_domains')
-                else:
-                    final_templates.append('admin/testmail/no_secure_domains')
-
-                # Add success message
-                final_templates.append('admin/testmail/success')
+                final_templates = status_templates + ['admin/testmail/success']
 
                 # Add fallback info if applicable
                 fallback_provider = ''
-                if not forced_provider:
-                    provider_order = email_manager._select_provider_for_email(target_email)
-                    if len(provider_order) > 1:
-                        final_templates.append('admin/testmail/fallback')
-                        fallback_provider = provider_order[1].upper()
+                if provider_order and len(provider_order) > 1:
+                    final_templates.append('admin/testmail/fallback')
+                    fallback_provider = provider_order[1].upper()
 
                 await self.message_manager.send_template(
                     user=admin_user,
                     template_key=final_templates,
                     variables={
-                        'smtp_host': config.SMTP_HOST,
-                        'smtp_port': config.SMTP_PORT,
-                        'smtp_status': '✅ OK' if providers_status.get('smtp', False) else '❌ FAIL',
-                        'mailgun_domain': config.MAILGUN_DOMAIN,
-                        'mailgun_region': config.MAILGUN_REGION,
-                        'mailgun_status': '✅ OK' if providers_status.get('mailgun', False) else '❌ FAIL',
-                        'domains': ', '.join(email_manager.secure_domains) if email_manager.secure_domains else '',
+                        **base_vars,
                         'target_email': target_email,
                         'provider': selected_provider.upper(),
                         'fallback_provider': fallback_provider
@@ -1173,20 +1460,13 @@ class AdminCommands:
                     edit=True
                 )
             else:
-                error_templates = ['admin/testmail/header']
-                error_templates.append('admin/testmail/send_error')
+                error_templates = ['admin/testmail/header', 'admin/testmail/send_error']
 
                 await self.message_manager.send_template(
                     user=admin_user,
                     template_key=error_templates,
                     variables={
-                        'smtp_host': config.SMTP_HOST,
-                        'smtp_port': config.SMTP_PORT,
-                        'smtp_status': '✅ OK' if providers_status.get('smtp', False) else '❌ FAIL',
-                        'mailgun_domain': config.MAILGUN_DOMAIN,
-                        'mailgun_region': config.MAILGUN_REGION,
-                        'mailgun_status': '✅ OK' if providers_status.get('mailgun', False) else '❌ FAIL',
-                        'domains': ', '.join(email_manager.secure_domains) if email_manager.secure_domains else '',
+                        **base_vars,
                         'target_email': target_email,
                         'provider': selected_provider.upper()
                     },
@@ -1221,7 +1501,7 @@ class AdminCommands:
         """
         try:
             # Parse command arguments
-            command_parts = message.text.strip().split()
+            command_parts = message.text.split()
             test_mode = '--test' in command_parts
             no_email = '--nomail' in command_parts
             check_status = '--status' in command_parts
@@ -1244,7 +1524,7 @@ class AdminCommands:
                     f"Progress: {stats['bot_sent'] + stats['email_sent']}/{stats['total_recipients']}\n"
                     f"✅ Bot sent: {stats['bot_sent']}\n"
                     f"📧 Emails sent: {stats['email_sent']}\n"
-                    f"❌ Errors: {len(stats['errors'])}"
+                    f"❌ Errors: {stats['error_count']}"
                 )
                 await message.reply(status_msg, parse_mode="HTML")
                 return
@@ -1303,7 +1583,7 @@ class AdminCommands:
                         f"Processed: {processed}/{stats['total_recipients']}\n"
                         f"✅ Bot sent: {stats['bot_sent']}\n"
                         f"📧 Emails sent: {stats['email_sent']}\n"
-                        f"❌ Errors: {len(stats['errors'])}"
+                        f"❌ Errors: {stats['error_count']}"
                     )
                     await message.bot.send_message(
                         chat_id=admin_id,
@@ -1353,162 +1633,173 @@ class AdminCommands:
             logger.error(f"Error in broadcast command: {e}", exc_info=True)
 
 
-    async def handle_admin_command(self, message: types.Message, state: FSMContext):
-        """Обработчик админских команд"""
+    async def handle_upro(self, message: types.Message):
+        """&upro - обновление Projects и Options"""
+        try:
+            clear_template_cache()
+            logger.info("BookStack template cache cleared")
+            await self._import_sheet(message, ProjectImporter, "Projects")
+            await self._import_sheet(message, OptionImporter, "Options")
+        except Exception as e:
+            error_msg = f"❌ Ошибка при обновлении проектов: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            await message.reply(error_msg)
 
-        current_state = await state.get_state()
-        if current_state:
-            await state.finish()
-            logger.info(f"Сброшено состояние {current_state} для администратора")
+    async def handle_ut(self, message: types.Message):
+        """&ut - обновление шаблонов"""
+        try:
+            reply = await message.reply("🔄 Обновляю шаблоны...")
+            await MessageTemplates.load_templates()
+            await reply.edit_text("✅ Шаблоны успешно обновлены")
+        except Exception as e:
+            error_msg = f"❌ Ошибка обновления шаблонов: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            await message.reply(error_msg)
 
-        command = message.text[1:].split()[0].lower()
-        logger.info(f"Processing admin command: {command}")
+    async def handle_check(self, message: types.Message):
+        """&check - проверка платежей"""
+        try:
+            reply = await message.reply("🔍 Проверяю платежи...")
+
+            # Все записи команды фиксируются одним commit; после него платежи
+            # только читаются для отчета, поэтому commit не должен их expire-ить
+            async with self._combined_writes(expire_on_commit=False) as session:
+                # Литерал вместо bind-параметра, чтобы SQLite мог выбрать частичный индекс ix_payments_check
+                pending_payments = session.query(Payment).filter(
+                    Payment.status == literal_column("'check'")
+                ).all()
+                if not pending_payments:
+                    await reply.edit_text("✅ Непроверенных платежей нет")
+                    return
 
-        # ОСНОВНЫЕ КОМАНДЫ
-        if command == "import":
-            await self.handle_import(message)
+                payment_ids = [payment.paymentID for payment in pending_payments]
+
+                # Удаляем старые уведомления пачками по PAYMENT_CHECK_CHUNK платежей;
+                # записи, созданные до появления related_entity_id, ищем по тексту
+                for start in range(0, len(payment_ids), PAYMENT_CHECK_CHUNK):
+                    chunk = payment_ids[start:start + PAYMENT_CHECK_CHUNK]
+                    session.query(Notification).filter(
+                        Notification.source == "payment_checker",
+                        or_(
+                            and_(
+                                Notification.related_entity_type == "payment",
+                                Notification.related_entity_id.in_(chunk)
+                            ),
+                            and_(
+                                Notification.related_entity_id.is_(None),
+                                or_(*(
+                                    Notification.text.like(f"%payment_id: {payment_id}%")
+                                    for payment_id in chunk
+                                ))
+                            )
+                        )
+                    ).delete(**NO_SYNC)
 
-        elif command == "restore":
-            await self.handle_restore(message)
+                # Плательщики одним запросом
+                payers = {
+                    payer.userID: payer
+                    for payer in session.query(User).filter(
+                        User.userID.in_({payment.userID for payment in pending_payments})
+                    )
+                }
+
+                # Создаем новые уведомления в той же транзакции, что и удаление
+                from main import create_payment_check_notification
+                payments_to_notify = [payment for payment in pending_payments if payment.userID in payers]
+                results = await asyncio.gather(
+                    *(create_payment_check_notification(payment, payers[payment.userID], session=session)
+                      for payment in payments_to_notify),
+                    return_exceptions=True
+                )
 
-        elif command == "object":
-            await self.handle_object(message)
+            # Платежи уже загружены, отдельный SUM-запрос не нужен
+            total_amount = sum(payment.amount or 0 for payment in pending_payments)
+            report = f"💰 В системе ожидает проверки {len(pending_payments)} платежей на сумму ${total_amount:.2f}"
 
-        elif command == "upconfig":
-            await self.handle_upconfig(message)
+            notifications_created = 0
+            for payment, result in zip(payments_to_notify, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error creating notification for payment {payment.paymentID}: {result}")
+                else:
+                    notifications_created += 1
 
-        elif command == "upro":
-            # Обновление Projects и Options
-            try:
-                clear_template_cache()
-                logger.info("BookStack template cache cleared")
-                await self._import_sheet(message, ProjectImporter, "Projects")
-                await self._import_sheet(message, OptionImporter, "Options")
-            except Exception as e:
-                error_msg = f"❌ Ошибка при обновлении проектов: {str(e)}"
-                logger.error(error_msg, exc_info=True)
-                await message.reply(error_msg)
+            report += f"\n✅ Создано {notifications_created} новых уведомлений для администраторов"
+            await reply.edit_text(report)
 
-        elif command == "ut":
-            # Обновление шаблонов
+        except Exception as e:
+            error_msg = f"❌ Ошибка при проверке платежей: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            await message.reply(error_msg)
+
+    async def handle_legacy(self, message: types.Message):
+        """&legacy - ручной запуск legacy миграции"""
+        try:
+            reply = await message.reply("🔄 Запускаю legacy миграцию...")
+            from legacy_user_processor import legacy_processor
             try:
-                reply = await message.reply("🔄 Обновляю шаблоны...")
-                await MessageTemplates.load_templates()
-                await reply.edit_text("✅ Шаблоны успешно обновлены")
-            except Exception as e:
-                error_msg = f"❌ Ошибка обновления шаблонов: {str(e)}"
-                logger.error(error_msg, exc_info=True)
-                await message.reply(error_msg)
+                # This will raise RuntimeError if migration is already running
+                stats = await legacy_processor._process_legacy_users()
+
+                # Build detailed report
+                report = f"📊 Legacy Migration Report:\n\n"
+                report += f"📋 Total records: {stats.total_records}\n"
+                report += f"👤 Users found: {stats.users_found}\n"
+                report += f"👥 Upliners assigned: {stats.upliners_assigned}\n"
+                report += f"📈 Purchases created: {stats.purchases_created}\n"
+                report += f"✅ Completed: {stats.completed}\n"
+                report += f"❌ Errors: {stats.errors}\n"
+
+                # Add summary based on results
+                if stats.users_found == 0 and stats.upliners_assigned == 0 and stats.purchases_created == 0:
+                    report += "\n🔍 No new legacy users found to process."
+                else:
+                    report += "\n🎯 Legacy migration processing completed!"
 
-        elif command.startswith("delpurchase"):
-            await self.handle_delpurchase(message)
+                # Add error details if any
+                if stats.errors > 0 and stats.error_details:
+                    report += "\n\n⚠️ Error details (first 10):\n"
+                    for email, error in stats.error_details[:10]:
+                        report += f"• {email}: {error}\n"
+                await reply.edit_text(report)
 
-        elif command == "addbalance":
-            await self.handle_addbalance(message)
 
-        elif command == "testmail":
-            await self.handle_testmail(message)
+            except RuntimeError as e:
+                if "already in progress" in str(e):
+                    await reply.edit_text(
+                        "⚠️ Автоматическая миграция идёт прямо сейчас.\n"
+                        "Читайте логи для отслеживания прогресса.\n\n"
+                        "Миграция запускается автоматически каждые 10 минут."
+                    )
 
-        elif command == "broadcast":
-            await self.handle_broadcast(message)
+                else:
+                    raise
+        except Exception as e:
+            error_msg = f"❌ Ошибка при legacy миграции: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            await message.reply(error_msg)
 
-        elif command == "check":
-            # Проверка платежей
-            try:
-                reply = await message.reply("🔍 Проверяю платежи...")
-
-                with Session() as session:
-                    pending_payments = session.query(Payment).filter_by(status="check").all()
-                    total_amount = session.query(func.sum(Payment.amount)).filter_by(status="check").scalar() or 0
-
-                    if pending_payments:
-                        report = f"💰 В системе ожидает проверки {len(pending_payments)} платежей на сумму ${total_amount:.2f}"
-
-                        # Удаляем старые уведомления
-                        for payment in pending_payments:
-                            existing_notifications = (
-                                session.query(Notification)
-                                .filter(
-                                    Notification.source == "payment_checker",
-                                    Notification.text.like(f"%payment_id: {payment.paymentID}%")
-                                )
-                                .all()
-                            )
-                            for notif in existing_notifications:
-                                session.delete(notif)
-
-                        session.commit()
-
-                        # Создаем новые уведомления
-                        notifications_created = 0
-                        for payment in pending_payments:
-                            payer = session.query(User).filter_by(userID=payment.userID).first()
-                            if not payer:
-                                continue
-
-                            try:
-                                from main import create_payment_check_notification
-                                await create_payment_check_notification(payment, payer)
-                                notifications_created += 1
-                            except Exception as e:
-                                logger.error(f"Error creating notification for payment {payment.paymentID}: {e}")
-
-                        report += f"\n✅ Создано {notifications_created} новых уведомлений для администраторов"
-                        await reply.edit_text(report)
-                    else:
-                        await reply.edit_text("✅ Непроверенных платежей нет")
+    async def handle_admin_command(self, message: types.Message, state: FSMContext, state_reset: bool = False):
+        """Обработчик админских команд
 
-            except Exception as e:
-                error_msg = f"❌ Ошибка при проверке платежей: {str(e)}"
-                logger.error(error_msg, exc_info=True)
-                await message.reply(error_msg)
+        state_reset=True передает middleware, которое уже сбросило состояние,
+        чтобы не читать его из хранилища второй раз.
+        """
+        if not state_reset:
+            current_state = await state.get_state()
+            if current_state:
+                await state.finish()
+                logger.info(f"Сброшено состояние {current_state} для администратора")
 
-        elif command == "legacy":
+        # Нужно только первое слово - не разбиваем весь текст команды
+        command = message.text[1:].split(maxsplit=1)[0].lower()
+        logger.info(f"Processing admin command: {command}")
 
-            try:
-                reply = await message.reply("🔄 Запускаю legacy миграцию...")
-                from legacy_user_processor import legacy_processor
-                try:
-                    # This will raise RuntimeError if migration is already running
-                    stats = await legacy_processor._process_legacy_users()
-
-                    # Build detailed report
-                    report = f"📊 Legacy Migration Report:\n\n"
-                    report += f"📋 Total records: {stats.total_records}\n"
-                    report += f"👤 Users found: {stats.users_found}\n"
-                    report += f"👥 Upliners assigned: {stats.upliners_assigned}\n"
-                    report += f"📈 Purchases created: {stats.purchases_created}\n"
-                    report += f"✅ Completed: {stats.completed}\n"
-                    report += f"❌ Errors: {stats.errors}\n"
-
-                    # Add summary based on results
-                    if stats.users_found == 0 and stats.upliners_assigned == 0 and stats.purchases_created == 0:
-                        report += "\n🔍 No new legacy users found to process."
-                    else:
-                        report += "\n🎯 Legacy migration processing completed!"
-
-                    # Add error details if any
-                    if stats.errors > 0 and stats.error_details:
-                        report += "\n\n⚠️ Error details (first 10):\n"
-                        for email, error in stats.error_details[:10]:
-                            report += f"• {email}: {error}\n"
-                    await reply.edit_text(report)
-
-
-                except RuntimeError as e:
-                    if "already in progress" in str(e):
-                        await reply.edit_text(
-                            "⚠️ Автоматическая миграция идёт прямо сейчас.\n"
-                            "Читайте логи для отслеживания прогресса.\n\n"
-                            "Миграция запускается автоматически каждые 10 минут."
-                        )
+        handler = self._commands.get(command)
+        if handler is None and command.startswith("delpurchase"):
+            handler = self.handle_delpurchase
 
-                    else:
-                        raise
-            except Exception as e:
-                error_msg = f"❌ Ошибка при legacy миграции: {str(e)}"
-                logger.error(error_msg, exc_info=True)
-                await message.reply(error_msg)
+        if handler:
+            await handler(message)
 
 
 def setup_admin_commands(dp, message_manager):
@@ -17,73 +17,84 @@ async def process_purchase_bonuses(session: Session, purchase: Purchase) -> List
     Returns list of created bonuses
     """
     created_bonuses = []
+    credited = []  # (bonus, upline_user, level) in chain order
     current_user = purchase.user
     level = 1
 
-    while True:
-        # Stop if we've reached the default referrer or max levels
-        if (not current_user.upline or
-                current_user.upline == config.DEFAULT_REFERRER_ID or
-                f"level_{level}" not in config.PURCHASE_BONUSES):
-            break
-
-        # Get upline user
-        upline_user = session.query(User).filter_by(
-            telegramID=current_user.upline
-        ).first()
-
-        if not upline_user:
-            logger.warning(f"Upline user not found for user {current_user.userID}")
-            break
-
-        # Calculate bonus
-        bonus_rate = config.PURCHASE_BONUSES[f"level_{level}"] / 100.0
-        bonus_amount = purchase.packPrice * bonus_rate  # Используем packPrice вместо amount
-
-        now = datetime.utcnow()
-        bonus = Bonus(
-            userID=upline_user.userID,
-            downlineID=purchase.userID,
-            purchaseID=purchase.purchaseID,
-            projectID=purchase.projectID,
-            optionID=purchase.optionID,
-            packQty=purchase.packQty,
-            packPrice=purchase.packPrice,
-            uplineLevel=level,
-            bonusRate=bonus_rate,
-            bonusAmount=bonus_amount,
-            status="paid",
-            createdAt=now,
-            notes="autogenerated:1"
-        )
-        session.add(bonus)
-        session.flush()
-
-        # Update user's passive balance
-        upline_user.balancePassive += bonus_amount
-
-        # Создаем запись в PassiveBalance
-        passive_balance_record = PassiveBalance(
+    # Upline lookups must not flush each pending bonus: the chain is flushed once below
+    with session.no_autoflush:
+        while True:
+            # Stop if we've reached the default referrer or max levels
+            if (not current_user.upline or
+                    current_user.upline == config.DEFAULT_REFERRER_ID or
+                    f"level_{level}" not in config.PURCHASE_BONUSES):
+                break
+
+            # Get upline user
+            upline_user = session.query(User).filter_by(
+                telegramID=current_user.upline
+            ).first()
+
+            if not upline_user:
+                logger.warning(f"Upline user not found for user {current_user.userID}")
+                break
+
+            # Calculate bonus
+            bonus_rate = config.PURCHASE_BONUSES[f"level_{level}"] / 100.0
+            bonus_amount = purchase.packPrice * bonus_rate  # Используем packPrice вместо amount
+
+            now = datetime.utcnow()
+            bonus = Bonus(
+                userID=upline_user.userID,
+                downlineID=purchase.userID,
+                purchaseID=purchase.purchaseID,
+                projectID=purchase.projectID,
+                optionID=purchase.optionID,
+                packQty=purchase.packQty,
+                packPrice=purchase.packPrice,
+                uplineLevel=level,
+                bonusRate=bonus_rate,
+                bonusAmount=bonus_amount,
+                status="paid",
+                createdAt=now,
+                notes="autogenerated:1"
+            )
+            session.add(bonus)
+
+            # Update user's passive balance
+            upline_user.balancePassive += bonus_amount
+
+            credited.append((bonus, upline_user, level))
+
+            # Move up the chain
+            current_user = upline_user
+            level += 1
+
+    if not credited:
+        return created_bonuses
+
+    # One flush for the whole chain assigns every bonusID needed for the reasons below
+    session.flush()
+
+    session.add_all([
+        PassiveBalance(
             userID=upline_user.userID,
             firstname=upline_user.firstname,
             surname=upline_user.surname,
-            amount=bonus_amount,  # Положительная сумма для начисления
+            amount=bonus.bonusAmount,  # Положительная сумма для начисления
             status='done',
             reason=f'bonus={bonus.bonusID}',  # ID бонуса как reason
             link='',  # Пока пустой
             notes=f'Referral bonus level {level}'
         )
-        session.add(passive_balance_record)
+        for bonus, upline_user, level in credited
+    ])
 
+    for bonus, upline_user, _ in credited:
         # Create notification
         await create_bonus_notification(session, bonus, upline_user)
-
         created_bonuses.append(bonus)
 
-        # Move up the chain
-        current_user = upline_user
-        level += 1
-
     return created_bonuses
 
 
@@ -1,10 +1,17 @@
 import logging
+import time
+import orjson
 import requests
-from typing import Dict, Any
-from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, Tuple
+from urllib.parse import urlencode, urljoin
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
+REQUEST_TIMEOUT = 10  # секунд на запрос к API
+PAGE_ID_CACHE_TTL = 600  # секунд, как у TemplateCache
+
 
 class BookStackAPIError(Exception):
     """Исключение для ошибок API BookStack"""
@@ -17,20 +24,32 @@ class BookStackClient:
         self.base_url = base_url.rstrip('/')
         self.token_id = token_id
         self.token_secret = token_secret
+        self.timeout = REQUEST_TIMEOUT
+        self._page_ids: Dict[Tuple[str, str], Tuple[float, int]] = {}
         self.session = requests.Session()
         self.session.headers.update({
             'Authorization': f'Token {token_id}:{token_secret}',
-            'Accept': 'application/json'
+            'Accept': 'application/json',
+            'Connection': 'keep-alive'
         })
 
+        # Пул соединений с повторами на временных ошибках сервера
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=10,
+            max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504])
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
     def _make_request(self, endpoint: str) -> Dict[str, Any]:
         """Выполнение GET-запроса к API BookStack"""
         url = urljoin(f"{self.base_url}/api/", endpoint.lstrip('/'))
 
         try:
-            response = self.session.get(url)
+            response = self.session.get(url, timeout=self.timeout)
             response.raise_for_status()
-            return response.json()
+            return orjson.loads(response.content)
         except Exception as e:
             error_msg = f"BookStack API error: {e}"
             logger.error(error_msg)
@@ -47,19 +66,34 @@ class BookStackClient:
         Returns:
             Данные страницы
         """
+        page_id = self._resolve_page_id(book_slug, page_slug)
+        return self._make_request(f'/pages/{page_id}')
+
+    def _resolve_page_id(self, book_slug: str, page_slug: str) -> int:
+        """ID страницы по слагам с кешированием на PAGE_ID_CACHE_TTL"""
+        key = (book_slug, page_slug)
+        cached = self._page_ids.get(key)
+        if cached and time.monotonic() - cached[0] < PAGE_ID_CACHE_TTL:
+            return cached[1]
+
         # Получаем книгу
         book = self._make_request(f'/books/slug/{book_slug}')
 
-        # Получаем страницы книги
-        pages = self._make_request(f'/books/{book["id"]}/pages')
-
-        # Ищем нужную страницу
-        for page in pages.get('data', []):
-            if page['slug'] == page_slug:
-                # Получаем полные данные страницы
-                return self._make_request(f'/pages/{page["id"]}')
+        # Фильтр API отдает только нужную страницу вместо списка всей книги
+        query = urlencode({'filter[book_id]': book['id'], 'filter[slug]': page_slug})
+        pages = self._make_request(f'/pages?{query}').get('data', [])
+        if not pages:
+            # Запасной путь: перебор страниц книги
+            pages = [
+                page for page in self._make_request(f'/books/{book["id"]}/pages').get('data', [])
+                if page['slug'] == page_slug
+            ]
+        if not pages:
+            raise BookStackAPIError(f"Page {page_slug} not found in book {book_slug}")
 
-        raise BookStackAPIError(f"Page {page_slug} not found in book {book_slug}")
+        page_id = pages[0]['id']
+        self._page_ids[key] = (time.monotonic(), page_id)
+        return page_id
 
     def get_public_url(self, book_slug: str, page_slug: str = None) -> str:
         """Формирование публичного URL для книги или страницы"""
@@ -1,10 +1,20 @@
+import asyncio
+import functools
+import hashlib
 import logging
+import io
 import tempfile
+import threading
 import jinja2
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
-from bs4 import BeautifulSoup
-from datetime import datetime
+import shutil
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from lxml import etree, html as lxml_html
 from typing import Optional, Dict, Any
 
 import config
@@ -12,43 +22,325 @@ from bookstack_client import BookStackClient, BookStackAPIError
 
 logger = logging.getLogger(__name__)
 
+# Исходники шаблонов для загрузчика: кладутся перед get_template() и сразу убираются
+_TEMPLATE_SOURCES = {}  # {имя шаблона (хеш HTML): HTML}
+
+
+def _jinja_bytecode_cache() -> Optional[jinja2.BytecodeCache]:
+    """Байткод шаблонов на диске - после рестарта документы не компилируются заново"""
+    try:
+        os.makedirs(config.JINJA_CACHE_DIR, exist_ok=True)
+        return jinja2.FileSystemBytecodeCache(str(config.JINJA_CACHE_DIR))
+    except OSError as e:
+        logger.warning(f"Кеш байткода Jinja2 отключен: {e}")
+        return None
+
+
+# Общее окружение Jinja2 для всех документов.
+# bytecode_cache работает только через загрузчик, поэтому вместо from_string
+# шаблоны берутся get_template() по имени = хешу HTML. Скомпилированные шаблоны
+# держит TemplateCache, собственный кеш окружения не нужен (cache_size=0)
+_JINJA_ENV = jinja2.Environment(
+    loader=jinja2.FunctionLoader(_TEMPLATE_SOURCES.get),
+    bytecode_cache=_jinja_bytecode_cache(),
+    auto_reload=False,
+    cache_size=0,
+    autoescape=True,
+    undefined=jinja2.make_logging_undefined(
+        logger=logger,
+        base=jinja2.DebugUndefined
+    )
+)
+
+# Публичные страницы BookStack: одна сессия с keep-alive на все запросы
+_HTTP = requests.Session()
+_HTTP_ADAPTER = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+)
+_HTTP.mount('https://', _HTTP_ADAPTER)
+_HTTP.mount('http://', _HTTP_ADAPTER)
+HTTP_TIMEOUT = (3.05, 10)  # (connect, read) секунд
+STREAM_CHUNK_SIZE = 8192
+
+
+def _stream_page_content(response: requests.Response) -> Optional[lxml_html.HtmlElement]:
+    """
+    Инкрементальный разбор страницы: разбор прекращается, как только
+    закрылся блок .page-content, остаток страницы лишь дочитывается
+    """
+    # Байты идут в парсер как есть: ни response.text, ни определения кодировки
+    # через charset_normalizer. Кодировка - из Content-Type, иначе UTF-8 BookStack
+    content_type = response.headers.get('content-type', '').lower()
+    encoding = response.encoding if 'charset=' in content_type else 'utf-8'
+    parser = etree.HTMLPullParser(events=('end',), encoding=encoding)
+    # HtmlElement нужен для drop_tree() и lxml.html.tostring()
+    parser.set_element_class_lookup(lxml_html.HtmlElementClassLookup())
+
+    chunks = response.iter_content(STREAM_CHUNK_SIZE)
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, element in parser.read_events():
+            if 'page-content' in (element.get('class') or '').split():
+                # Тело дочитываем без разбора: urllib3 возвращает соединение
+                # в пул только после полного чтения ответа (keep-alive)
+                for _ in chunks:
+                    pass
+                return element
+
+    # Страница кончилась - дочитываем хвост парсера (незакрытые теги)
+    parser.close()
+    for _, element in parser.read_events():
+        if 'page-content' in (element.get('class') or '').split():
+            return element
+    return None
+
+
+# Базовые стили PDF; у WeasyPrint нет опций полей страницы, поэтому margin в CSS
+_PDF_STYLE = """
+    body { font-family: Arial, sans-serif; }
+    h1, h2, h3 { color: #333; }
+    table { border-collapse: collapse; width: 100%; margin: 1em 0; }
+    th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
+    th { background-color: #f2f2f2; }
+"""
+_WEASYPRINT_STYLE = _PDF_STYLE + "    body { margin: 2cm; }\n"
+_WEASYPRINT_HEAD = f"    <style>{_WEASYPRINT_STYLE}</style>\n"
+
+# wkhtmltopdf получает стили файлом (--user-style-sheet), а не в каждом HTML.
+# Файл лежит в приватном каталоге (mkdtemp, права 0700), а не по предсказуемому пути в /tmp
+_PDF_STYLE_DIR: Optional[str] = None
+_PDF_STYLESHEET_PATH: Optional[str] = None
+_PDF_STYLESHEET_LOCK = threading.Lock()
+_PDFKIT_INLINE_HEAD = f"    <style>{_PDF_STYLE}</style>\n"  # если файл записать не удалось
+
+_STYLED_WRAPPER = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+{head}</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+# Настройки для wkhtmltopdf
+_PDFKIT_OPTIONS = {
+    'encoding': 'UTF-8',
+    'page-size': 'A4',
+    'margin-top': '2cm',
+    'margin-right': '2cm',
+    'margin-bottom': '2cm',
+    'margin-left': '2cm',
+    'footer-right': '[page]/[topage]',
+    'footer-font-size': '9',
+    'no-outline': None,
+    'quiet': ''
+}
+
+
+def _find_wkhtmltopdf() -> Optional[str]:
+    """Поиск бинарника wkhtmltopdf (выполняется один раз при импорте)"""
+    # Сначала стандартный путь, затем PATH (shutil.which без запуска процесса),
+    # затем другие стандартные места
+    if os.path.exists('/usr/bin/wkhtmltopdf'):
+        return '/usr/bin/wkhtmltopdf'
+    return shutil.which('wkhtmltopdf') or next(
+        (path for path in ('/usr/local/bin/wkhtmltopdf', '/bin/wkhtmltopdf') if os.path.exists(path)),
+        None
+    )
+
+
+def _write_pdf_stylesheet() -> Optional[str]:
+    """Запись CSS для wkhtmltopdf в приватный каталог; путь к файлу или None при ошибке"""
+    global _PDF_STYLE_DIR
+    tmp_path = None
+    try:
+        # Каталог мог удалить чистильщик /tmp - создаем новый, а не восстанавливаем старый путь
+        if _PDF_STYLE_DIR is None or not os.path.isdir(_PDF_STYLE_DIR):
+            _PDF_STYLE_DIR = tempfile.mkdtemp(prefix='talentir_pdf_')
+        path = os.path.join(_PDF_STYLE_DIR, 'pdf.css')
+        # mkstemp создает новый файл (O_EXCL) и не идет по чужим симлинкам;
+        # os.replace - чтобы параллельный рендер не прочитал половину файла
+        fd, tmp_path = tempfile.mkstemp(dir=_PDF_STYLE_DIR, suffix='.css')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(_PDF_STYLE)
+        os.replace(tmp_path, path)
+        return path
+    except OSError as e:
+        logger.warning(f"Не удалось записать CSS для PDF, стили остаются в HTML: {e}")
+        if tmp_path:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        return None
+
+
+def _pdfkit_style() -> tuple:
+    """Заголовок HTML и опции wkhtmltopdf; файл стилей перезаписывается, если его удалили"""
+    global _PDF_STYLESHEET_PATH
+    path = _PDF_STYLESHEET_PATH
+    if path is None or not os.path.exists(path):
+        with _PDF_STYLESHEET_LOCK:
+            path = _PDF_STYLESHEET_PATH
+            if path is None or not os.path.exists(path):
+                path = _PDF_STYLESHEET_PATH = _write_pdf_stylesheet()
+    if path is None:
+        return _PDFKIT_INLINE_HEAD, _PDFKIT_OPTIONS
+    return '', {**_PDFKIT_OPTIONS, 'user-style-sheet': path}
+
+
+# Путь к wkhtmltopdf и конфигурация pdfkit не меняются за время жизни процесса
+try:
+    import pdfkit
+
+    _WKHTMLTOPDF_PATH = _find_wkhtmltopdf()
+    if not _WKHTMLTOPDF_PATH:
+        raise FileNotFoundError("wkhtmltopdf не найден")
+    _PDFKIT_CONFIG = pdfkit.configuration(wkhtmltopdf=_WKHTMLTOPDF_PATH)
+    logger.info(f"Using wkhtmltopdf from: {_WKHTMLTOPDF_PATH}")
+    _PDF_STYLESHEET_PATH = _write_pdf_stylesheet()
+except Exception as e:
+    logger.warning(f"pdfkit не будет использоваться, PDF через WeasyPrint: {e}")
+    _WKHTMLTOPDF_PATH = None
+    _PDFKIT_CONFIG = None
+
+# wkhtmltopdf и так работает отдельным процессом, поэтому пул процессов не нужен:
+# пул потоков лишь ограничивает число одновременных рендеров числом ядер
+_PDF_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix='pdf')
+
+
+@functools.lru_cache(maxsize=2048)
+def _book_slug(lang: str, docs_folder: Optional[str]) -> str:
+    """Слаг книги проекта: docsFolder, иначе стандартный слаг по языку"""
+    # Проверяем наличие docsFolder
+    if docs_folder and docs_folder.strip():
+        return docs_folder.strip()
+
+    # Формируем стандартный слаг на основе языка
+    return f"jetup-{lang}"
+
+
+@functools.lru_cache(maxsize=2048)
+def _document_url(book_slug: str, doc_slug: str) -> str:
+    """Публичный URL страницы BookStack"""
+    return f"{config.BOOKSTACK_URL}/books/{book_slug}/page/{doc_slug}"
+
 
 class TemplateCache:
     """Класс для кеширования HTML-шаблонов из BookStack"""
-    _cache = {}  # {key: (html, timestamp)}
+    _cache = OrderedDict()  # {key: (html, monotonic timestamp)}, порядок - LRU
+    _compiled = {}  # {html: jinja2.Template} - живут, пока HTML есть в _cache
+    _missing = OrderedDict()  # {key: monotonic timestamp} - документы, которых нет в BookStack
     _ttl = 600
+    _missing_ttl = 60
+    _max_size = 512
+    # Кеш читается и меняется из потоков (asyncio.to_thread, пул PDF):
+    # все обращения к _cache, _missing и _compiled - под _lock
+    _lock = threading.Lock()
+    _compile_lock = threading.Lock()
 
     @classmethod
     def get(cls, key: str) -> Optional[str]:
         """Получение HTML из кеша с проверкой TTL"""
-        if key in cls._cache:
-            html, timestamp = cls._cache[key]
-            if (datetime.utcnow() - timestamp).total_seconds() < cls._ttl:
-                return html
+        with cls._lock:
+            entry = cls._cache.get(key)
+            if entry is not None:
+                html, timestamp = entry
+                if time.monotonic() - timestamp < cls._ttl:
+                    cls._cache.move_to_end(key)
+                    return html
         return None
 
     @classmethod
     def set(cls, key: str, html: str) -> None:
         """Сохранение HTML в кеш"""
-        cls._cache[key] = (html, datetime.utcnow())
+        with cls._lock:
+            previous = cls._cache.get(key)
+            if previous and previous[0] != html:
+                # Документ изменился - старый скомпилированный шаблон больше не нужен
+                cls._compiled.pop(previous[0], None)
+            cls._cache[key] = (html, time.monotonic())
+            cls._cache.move_to_end(key)
+            cls._missing.pop(key, None)
+            while len(cls._cache) > cls._max_size:
+                # Вытесняем давно не использовавшиеся документы вместе с их шаблонами
+                _, (evicted_html, _) = cls._cache.popitem(last=False)
+                cls._compiled.pop(evicted_html, None)
+
+    @classmethod
+    def is_missing(cls, key: str) -> bool:
+        """Документ недавно не нашелся - повторно не запрашиваем до истечения _missing_ttl"""
+        with cls._lock:
+            marked_at = cls._missing.get(key)
+        return marked_at is not None and time.monotonic() - marked_at < cls._missing_ttl
+
+    @classmethod
+    def mark_missing(cls, key: str) -> None:
+        """Запоминание отсутствующего документа"""
+        with cls._lock:
+            cls._missing[key] = time.monotonic()
+            cls._missing.move_to_end(key)
+            while len(cls._missing) > cls._max_size:
+                cls._missing.popitem(last=False)
+
+    @classmethod
+    def get_compiled(cls, html: str) -> jinja2.Template:
+        """Скомпилированный шаблон для HTML; компиляция - один раз на документ"""
+        with cls._lock:
+            template = cls._compiled.get(html)
+        if template is None:
+            # Под блокировкой: один документ компилируется один раз, а _TEMPLATE_SOURCES
+            # не очищается чужим потоком посреди get_template().
+            # Сама компиляция идет без _lock, чтобы не задерживать чтение кеша
+            with cls._compile_lock:
+                with cls._lock:
+                    template = cls._compiled.get(html)
+                if template is None:
+                    name = hashlib.blake2b(html.encode('utf-8'), digest_size=16).hexdigest()
+                    _TEMPLATE_SOURCES[name] = html
+                    try:
+                        template = _JINJA_ENV.get_template(name)
+                    finally:
+                        _TEMPLATE_SOURCES.pop(name, None)
+                    with cls._lock:
+                        cls._compiled[html] = template
+        return template
 
     @classmethod
     def clear(cls):
         """Очистка кеша"""
-        cls._cache.clear()
+        with cls._lock:
+            cls._cache.clear()
+            cls._compiled.clear()
+            cls._missing.clear()
 
 
 class BookStackManager:
     """Менеджер для работы с BookStack"""
     _instance = None
     _client = None
+    # Менеджер используется из потоков (asyncio.to_thread, пул PDF) -
+    # создание экземпляра и клиента выполняется под блокировкой
+    _lock = threading.Lock()
+    _inflight = {}  # {cache_key: Future} - документы, которые сейчас загружаются
+    _inflight_lock = threading.Lock()
 
     def __new__(cls):
         """Реализация паттерна Singleton"""
-        if cls._instance is None:
-            cls._instance = super(BookStackManager, cls).__new__(cls)
-            cls._instance._initialize()
-        return cls._instance
+        instance = cls._instance
+        if instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super(BookStackManager, cls).__new__(cls)
+                    instance._initialize()
+                    # Публикуем экземпляр только после инициализации
+                    cls._instance = instance
+                instance = cls._instance
+        return instance
 
     def _initialize(self):
         """Инициализация клиента BookStack"""
@@ -65,11 +357,12 @@ class BookStackManager:
             return
 
         try:
-            self._client = BookStackClient(
+            client = BookStackClient(
                 base_url=config.BOOKSTACK_URL,
                 token_id=config.BOOKSTACK_TOKEN_ID,
                 token_secret=config.BOOKSTACK_TOKEN_SECRET
             )
+            self._client = client
             logger.info(f"BookStack клиент инициализирован для {config.BOOKSTACK_URL}")
         except Exception as e:
             logger.error(f"Ошибка инициализации BookStack клиента: {e}")
@@ -78,7 +371,9 @@ class BookStackManager:
     def client(self) -> Optional[BookStackClient]:
         """Получение клиента BookStack"""
         if not self._client:
-            self._initialize()
+            with self._lock:
+                if not self._client:
+                    self._initialize()
         return self._client
 
     def is_available(self) -> bool:
@@ -95,12 +390,7 @@ class BookStackManager:
         Returns:
             Слаг книги
         """
-        # Проверяем наличие docsFolder
-        if project.docsFolder and project.docsFolder.strip():
-            return project.docsFolder.strip()
-
-        # Формируем стандартный слаг на основе project ID и языка
-        return f"jetup-{project.lang}"
+        return _book_slug(project.lang, project.docsFolder)
 
     def get_document_html(self, project, doc_slug: str) -> Optional[str]:
         """
@@ -120,7 +410,36 @@ class BookStackManager:
         cached_html = TemplateCache.get(cache_key)
         if cached_html:
             return cached_html
+        if TemplateCache.is_missing(cache_key):
+            return None
 
+        # Одновременные запросы одного документа ждут первый, а не идут в BookStack сами
+        with self._inflight_lock:
+            cached_html = TemplateCache.get(cache_key)
+            if cached_html:
+                return cached_html
+            future = self._inflight.get(cache_key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[cache_key] = future
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            html = self._fetch_document_html(project, doc_slug, cache_key)
+            future.set_result(html)
+            return html
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(cache_key, None)
+
+    def _fetch_document_html(self, project, doc_slug: str, cache_key: str) -> Optional[str]:
+        """Загрузка документа из BookStack с сохранением результата в TemplateCache"""
         # Получаем слаг книги из проекта
         book_slug = self.get_book_slug(project)
         if not book_slug:
@@ -129,30 +448,32 @@ class BookStackManager:
 
         # Пробуем получить HTML с публичной страницы напрямую
         try:
-            url = f"{config.BOOKSTACK_URL}/books/{book_slug}/page/{doc_slug}"
+            url = _document_url(book_slug, doc_slug)
             logger.info(f"Fetching document from public URL: {url}")
-            response = requests.get(url)
-            response.raise_for_status()
+            with _HTTP.get(url, timeout=HTTP_TIMEOUT, stream=True) as response:
+                response.raise_for_status()
+                # Находим основной контейнер с содержимым, не дочитывая страницу
+                content_div = _stream_page_content(response)
 
-            # Парсим HTML и извлекаем контент
-            soup = BeautifulSoup(response.text, 'html.parser')
-            # Находим основной контейнер с содержимым
-            content_div = soup.select_one('.page-content')
+            if content_div is not None:
+                first_h1 = content_div.find('.//h1')
+                if first_h1 is not None:
+                    first_h1.drop_tree()
 
-            if content_div:
-                first_h1 = content_div.find('h1')
-                if first_h1:
-                    first_h1.decompose()
-
-                html = str(content_div)
+                html = lxml_html.tostring(content_div, encoding='unicode', with_tail=False)
                 TemplateCache.set(cache_key, html)
                 return html
 
             logger.warning(f"Content block not found in document at {url}")
+            TemplateCache.mark_missing(cache_key)
             return None
 
         except Exception as e:
             logger.error(f"Ошибка получения документа {doc_slug} для проекта {project.projectID} напрямую: {e}")
+            # В негативный кеш попадает только настоящее отсутствие страницы (404),
+            # а не таймауты и ошибки сервера
+            not_found = (isinstance(e, requests.HTTPError) and e.response is not None
+                         and e.response.status_code == 404)
 
             # Если не удалось получить напрямую, пробуем через API (как запасной вариант)
             if self.is_available():
@@ -170,6 +491,8 @@ class BookStackManager:
                 except Exception as e2:
                     logger.error(f"Ошибка получения документа через API: {e2}")
 
+            if not_found:
+                TemplateCache.mark_missing(cache_key)
             return None
 
     def render_template(self, html: str, context: Dict[str, Any]) -> str:
@@ -184,17 +507,8 @@ class BookStackManager:
             Отрендеренный HTML
         """
         try:
-            # Создаем окружение Jinja2
-            env = jinja2.Environment(
-                loader=jinja2.BaseLoader(),
-                autoescape=True,
-                undefined=jinja2.make_logging_undefined(
-                    logger=logger,
-                    base=jinja2.DebugUndefined
-                )
-            )
-            template = env.from_string(html)
-            return template.render(**context)
+            # Компилируем каждый HTML один раз; повторные рендеры берут готовый шаблон
+            return TemplateCache.get_compiled(html).render(**context)
         except Exception as e:
             logger.error(f"Ошибка рендеринга шаблона: {e}")
             return html
@@ -220,65 +534,15 @@ class BookStackManager:
 
             # Пробуем использовать pdfkit
             try:
-                import pdfkit
-
-                # Явно указываем путь к wkhtmltopdf
-                wkhtmltopdf_path = '/usr/bin/wkhtmltopdf'
-                if not os.path.exists(wkhtmltopdf_path):
-                    # Пробуем найти путь с помощью команды which
-                    import subprocess
-                    try:
-                        wkhtmltopdf_path = subprocess.check_output(['which', 'wkhtmltopdf']).decode().strip()
-                    except (subprocess.SubprocessError, FileNotFoundError):
-                        logger.warning("Could not find wkhtmltopdf using 'which' command")
-                        # Поиск в других стандартных местах
-                        for path in ['/usr/local/bin/wkhtmltopdf', '/bin/wkhtmltopdf']:
-                            if os.path.exists(path):
-                                wkhtmltopdf_path = path
-                                break
-
-                # Выводим информацию о найденном пути
-                logger.info(f"Using wkhtmltopdf from: {wkhtmltopdf_path}")
-
-                # Создаем конфигурацию с явным указанием пути
-                config = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf_path)
-
-                # Настройки для wkhtmltopdf
-                options = {
-                    'encoding': 'UTF-8',
-                    'page-size': 'A4',
-                    'margin-top': '2cm',
-                    'margin-right': '2cm',
-                    'margin-bottom': '2cm',
-                    'margin-left': '2cm',
-                    'footer-right': '[page]/[topage]',
-                    'footer-font-size': '9',
-                    'no-outline': None,
-                    'quiet': ''
-                }
+                if _PDFKIT_CONFIG is None:
+                    raise ImportError("pdfkit/wkhtmltopdf недоступны")
 
-                # Добавляем базовые стили для HTML
-                styled_html = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <meta charset="UTF-8">
-                    <style>
-                        body {{ font-family: Arial, sans-serif; }}
-                        h1, h2, h3 {{ color: #333; }}
-                        table {{ border-collapse: collapse; width: 100%; margin: 1em 0; }}
-                        th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-                        th {{ background-color: #f2f2f2; }}
-                    </style>
-                </head>
-                <body>
-                    {html}
-                </body>
-                </html>
-                """
+                # Добавляем базовые стили для HTML (файлом или, если его нет, в самом HTML)
+                head, options = _pdfkit_style()
+                styled_html = _STYLED_WRAPPER.format(head=head, body=html)
 
                 # Генерация PDF напрямую в байты с явным указанием конфигурации
-                pdf_bytes = pdfkit.from_string(styled_html, False, options=options, configuration=config)
+                pdf_bytes = pdfkit.from_string(styled_html, False, options=options, configuration=_PDFKIT_CONFIG)
 
                 if pdf_bytes:
                     logger.info(f"PDF successfully generated with pdfkit, size: {len(pdf_bytes)} bytes")
@@ -295,24 +559,7 @@ class BookStackManager:
                 import weasyprint
 
                 # Добавляем базовые стили для HTML
-                styled_html = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <meta charset="UTF-8">
-                    <style>
-                        body {{ font-family: Arial, sans-serif; margin: 2cm; }}
-                        h1, h2, h3 {{ color: #333; }}
-                        table {{ border-collapse: collapse; width: 100%; margin: 1em 0; }}
-                        th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-                        th {{ background-color: #f2f2f2; }}
-                    </style>
-                </head>
-                <body>
-                    {html}
-                </body>
-                </html>
-                """
+                styled_html = _STYLED_WRAPPER.format(head=_WEASYPRINT_HEAD, body=html)
 
                 # Генерация PDF
                 html_obj = weasyprint.HTML(string=styled_html)
@@ -343,7 +590,7 @@ class BookStackManager:
         book_slug = self.get_book_slug(project)
         if not book_slug:
             return None
-        return f"{config.BOOKSTACK_URL}/books/{book_slug}/page/{doc_slug}"
+        return _document_url(book_slug, doc_slug)
 
 
 # Функции для использования в main.py
@@ -405,7 +652,21 @@ def get_document_as_pdf(html: str) -> Optional[bytes]:
     return manager.generate_pdf(html)
 
 
-def get_document_as_temp_file(html: str) -> Optional[tempfile.SpooledTemporaryFile]:
+async def get_document_as_pdf_async(html: str) -> Optional[bytes]:
+    """
+    Асинхронное преобразование HTML в PDF в ограниченном пуле
+
+    Args:
+        html: HTML-контент
+
+    Returns:
+        PDF-документ в виде байтов или None в случае ошибки
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_PDF_POOL, get_document_as_pdf, html)
+
+
+def get_document_as_temp_file(html: str) -> Optional[io.BytesIO]:
     """
     Преобразование HTML в временный файл PDF
 
@@ -413,7 +674,7 @@ def get_document_as_temp_file(html: str) -> Optional[tempfile.SpooledTemporaryFi
         html: HTML-контент
 
     Returns:
-        Временный файл с PDF или None в случае ошибки
+        Файловый объект с PDF или None в случае ошибки
     """
     logger.debug("Attempting to convert HTML to PDF temp file")
 
@@ -430,26 +691,10 @@ def get_document_as_temp_file(html: str) -> Optional[tempfile.SpooledTemporaryFi
         logger.error("Не удалось получить PDF байты")
         return None
 
-    logger.debug(f"PDF bytes received, size: {len(pdf_bytes)} bytes")
+    logger.debug(f"PDF buffer size: {len(pdf_bytes)} bytes")
 
-    try:
-        # Создаем временный файл
-        temp_file = tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024, mode='w+b')
-        temp_file.write(pdf_bytes)
-        temp_file.seek(0)
-
-        # Проверяем размер файла
-        current_pos = temp_file.tell()
-        temp_file.seek(0, 2)  # Перемещаем курсор в конец файла
-        file_size = temp_file.tell()
-        temp_file.seek(current_pos)  # Возвращаем курсор в исходное положение
-
-        logger.debug(f"Temporary PDF file created, size: {file_size} bytes")
-
-        return temp_file
-    except Exception as e:
-        logger.error(f"Ошибка при создании временного файла: {e}", exc_info=True)
-        return None
+    # PDF уже в памяти - BytesIO оборачивает байты без копирования на диск
+    return io.BytesIO(pdf_bytes)
 
 
 def clear_template_cache():
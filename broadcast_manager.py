@@ -5,8 +5,12 @@ Sends notifications to Telegram bot and emails based on Google Sheets data
 
 import logging
 import asyncio
-from typing import Dict, List, Optional
+from collections import deque
+from contextlib import contextmanager
+from string import Formatter
+from typing import AsyncIterator, Dict, List, Optional
 from datetime import datetime
+from aiolimiter import AsyncLimiter
 from database import User, Notification
 from init import get_session
 from templates import MessageTemplates, SafeDict
@@ -24,9 +28,66 @@ logger.info("broadcast_manager: Session factory created")
 # Configuration
 BROADCAST_SHEET_URL = "https://docs.google.com/spreadsheets/d/1SeymB8GE2Zl6XQ4g3xIpDBHUkNFdp9yDMGUoYrBMKNg"
 BROADCAST_SHEET_NAME = "Recipients"  # Name of the sheet/tab with recipient data
-BATCH_SIZE = 50  # Emails per batch
-BATCH_DELAY = 3  # Seconds between batches
+BATCH_SIZE = 50  # Emails per BATCH_DELAY window (rate limit)
+BATCH_DELAY = 3  # Seconds per rate limit window
 PROGRESS_REPORT_EVERY = 200  # Send progress update every N recipients
+ERROR_SAMPLES = 10  # Failed rows shown in report
+BROADCAST_CONCURRENCY = 20  # Recipients processed in parallel
+SHEET_PAGE_ROWS = 1000  # Sheet rows read per request
+USER_LOOKUP_CHUNK = 500  # IDs per IN (...) query when resolving recipients
+BROADCAST_TEMPLATES = ('broadcast_bot', 'broadcast_email_subject', 'broadcast_email_body')
+
+
+class _CompiledTemplate:
+    """
+    Template for str.format_map(SafeDict(...)) parsed once per campaign.
+    Rendering joins pre-split literal parts with variable values, so the template
+    string is not re-parsed for every recipient. Templates with non-trivial fields
+    (attribute/index access, nested format specs) fall back to format_map.
+    """
+
+    def __init__(self, source: str, text_filter=None):
+        self._source = source
+        self._filter = text_filter
+        try:
+            parts = list(Formatter().parse(source))
+        except ValueError:
+            parts = None
+
+        if parts is not None and all(
+                field is None or (field.isidentifier() and '{' not in spec)
+                for _, field, spec, _ in parts
+        ):
+            # Filter (e.g. <br> fix) is applied to unchanging literal parts once, here
+            self._parts = [
+                (text_filter(literal) if text_filter else literal, field, spec, conversion)
+                for literal, field, spec, conversion in parts
+            ]
+        else:
+            self._parts = None
+
+    def render(self, variables: Dict) -> str:
+        """Format template with variables (missing ones are kept as {name})"""
+        if self._parts is None:
+            text = self._source.format_map(SafeDict(variables))
+            return self._filter(text) if self._filter else text
+
+        values = SafeDict(variables)
+        chunks = []
+        for literal, field, spec, conversion in self._parts:
+            chunks.append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            if conversion == 'r':
+                value = repr(value)
+            elif conversion == 's':
+                value = str(value)
+            elif conversion == 'a':
+                value = ascii(value)
+            text = format(value, spec)
+            chunks.append(self._filter(text) if self._filter else text)
+        return ''.join(chunks)
 
 
 class BroadcastManager:
@@ -34,7 +95,20 @@ class BroadcastManager:
 
     def __init__(self):
         self.google_services = None
-        self.stats = {
+        self.stats = self._empty_stats()
+        self.is_running = False
+        self.should_cancel = False
+        self.current_task = None
+        self._lock = asyncio.Lock()
+        # Leaky bucket shared by all workers: at most BATCH_SIZE emails per BATCH_DELAY seconds
+        self.email_limiter = AsyncLimiter(BATCH_SIZE, BATCH_DELAY)
+        self._template_cache: Dict[tuple, Optional[Dict]] = {}  # (name, lang) -> template
+        self._compiled_templates: Dict[tuple, _CompiledTemplate] = {}  # (text, fix_html) -> compiled
+
+    @staticmethod
+    def _empty_stats() -> Dict:
+        """Fresh campaign statistics"""
+        return {
             'total_recipients': 0,
             'bot_sent': 0,
             'bot_failed': 0,
@@ -42,12 +116,16 @@ class BroadcastManager:
             'email_failed': 0,
             'email_skipped': 0,  # Added for --nomail tracking
             'not_found_in_db': 0,
-            'errors': []
+            'error_count': 0,
+            # Only examples are kept for the report - memory doesn't grow with failed rows
+            'error_samples': deque(maxlen=ERROR_SAMPLES)
         }
-        self.is_running = False
-        self.should_cancel = False
-        self.current_task = None
-        self._lock = asyncio.Lock()
+
+    def _stats_snapshot(self) -> Dict:
+        """Copy of statistics safe to hand out while broadcast keeps updating them"""
+        snapshot = dict(self.stats)
+        snapshot['error_samples'] = list(self.stats['error_samples'])
+        return snapshot
 
     async def initialize(self):
         """Initialize Google Services"""
@@ -72,7 +150,7 @@ class BroadcastManager:
         """Get current broadcast status"""
         return {
             'is_running': self.is_running,
-            'stats': self.stats.copy()
+            'stats': self._stats_snapshot()
         }
 
     def _extract_sheet_id(self, url: str) -> str:
@@ -82,69 +160,77 @@ class BroadcastManager:
             return url.split('/d/')[1].split('/')[0]
         return url
 
-    async def read_recipients_from_sheet(self, sheet_url: str, test_mode: bool = False) -> List[Dict]:
+    async def read_recipients_from_sheet(self, sheet_url: str, test_mode: bool = False) -> AsyncIterator[List[Dict]]:
         """
-        Read recipients data from Google Sheets
+        Read recipients data from Google Sheets page by page
 
         Args:
             sheet_url: URL of Google Sheets document
             test_mode: If True, only read first 10 rows
 
-        Returns:
-            List of recipient dictionaries
+        Yields:
+            Lists of recipient dictionaries, one per SHEET_PAGE_ROWS rows
         """
         try:
             sheet_id = self._extract_sheet_id(sheet_url)
             logger.info(f"Reading recipients from sheet: {sheet_id}, tab: {BROADCAST_SHEET_NAME}")
 
             # Open spreadsheet and get worksheet using gspread
-            spreadsheet = self.google_services.open_by_key(sheet_id)
-            worksheet = spreadsheet.worksheet(BROADCAST_SHEET_NAME)
-
-            # Get all values
-            all_values = worksheet.get_all_values()
+            spreadsheet = await asyncio.to_thread(self.google_services.open_by_key, sheet_id)
+            worksheet = await asyncio.to_thread(spreadsheet.worksheet, BROADCAST_SHEET_NAME)
 
-            if not all_values:
+            # Parse headers (first row)
+            headers = [header.strip() for header in await asyncio.to_thread(worksheet.row_values, 1)]
+            if not headers:
                 logger.warning("No data found in sheet")
-                return []
+                return
+            logger.info(f"Found headers: {headers}")
 
-            # In test mode, limit to first 11 rows (header + 10 data rows)
-            if test_mode:
-                all_values = all_values[:11]
+            # In test mode, read only first 10 data rows
+            last_row = 11 if test_mode else worksheet.row_count  # Upper bound only
+            page_rows = 10 if test_mode else SHEET_PAGE_ROWS
+            parsed_count = 0
 
-            # Parse headers (first row)
-            headers = all_values[0]
-            logger.info(f"Found headers: {headers}")
+            # Read fixed row windows instead of get_all_values(): memory does not grow
+            # with the sheet, and processing of a page overlaps with reading the next one
+            for start in range(2, last_row + 1, page_rows):  # Skip header row
+                end = min(start + page_rows - 1, last_row)
+                rows = await asyncio.to_thread(worksheet.get, f"{start}:{end}")
+
+                recipients = []
+                for idx, row in enumerate(rows, start=start):
+                    try:
+                        recipient = {
+                            header: row[i].strip() if i < len(row) else ''
+                            for i, header in enumerate(headers)
+                        }
+
+                        # Validate that we have at least UserID or TelegramID or Email
+                        has_user_id = recipient.get('UserID', '').strip()
+                        has_telegram_id = recipient.get('TelegramID', '').strip()
+                        has_email = recipient.get('Email', '').strip()
+
+                        if not (has_user_id or has_telegram_id or has_email):
+                            logger.warning(f"Row {idx}: No UserID, TelegramID or Email - skipping")
+                            continue
 
-            # Parse data rows
-            recipients = []
-            for idx, row in enumerate(all_values[1:], start=2):  # Skip header row
-                try:
-                    # Ensure row has enough columns
-                    while len(row) < len(headers):
-                        row.append('')
-
-                    recipient = {}
-                    for i, header in enumerate(headers):
-                        recipient[header.strip()] = row[i].strip() if i < len(row) else ''
-
-                    # Validate that we have at least UserID or TelegramID or Email
-                    has_user_id = recipient.get('UserID', '').strip()
-                    has_telegram_id = recipient.get('TelegramID', '').strip()
-                    has_email = recipient.get('Email', '').strip()
-
-                    if not (has_user_id or has_telegram_id or has_email):
-                        logger.warning(f"Row {idx}: No UserID, TelegramID or Email - skipping")
+                        recipients.append(recipient)
+
+                    except Exception as e:
+                        logger.error(f"Error parsing row {idx}: {e}")
                         continue
 
-                    recipients.append(recipient)
+                if recipients:
+                    parsed_count += len(recipients)
+                    yield recipients
 
-                except Exception as e:
-                    logger.error(f"Error parsing row {idx}: {e}")
-                    continue
+                # row_count is the grid size, not the data size. The API trims trailing
+                # empty rows of each window, so only a completely empty page means the
+                # data has ended; a short page may just end with blank rows
+                if not rows:
+                    break
 
-            logger.info(f"Successfully parsed {len(recipients)} recipients from sheet")
-            return recipients
+            logger.info(f"Successfully parsed {parsed_count} recipients from sheet")
 
         except Exception as e:
             logger.error(f"Error reading sheet: {e}")
@@ -218,6 +304,82 @@ class BroadcastManager:
             logger.error(f"Error querying user by {field_name}={value}: {e}", exc_info=True)
             return None
 
+    def _load_users(self, recipients: List[Dict]) -> Dict[tuple, User]:
+        """
+        Resolve all recipients with bulk IN (...) queries instead of one query per row
+
+        Args:
+            recipients: Recipient dictionaries from sheet
+
+        Returns:
+            Dict of search tuple (as returned by find_user_in_db) -> detached User
+        """
+        ids_by_field = {'telegramID': set(), 'userID': set()}
+        for recipient_data in recipients:
+            search_tuple = self.find_user_in_db(
+                recipient_data.get('UserID', '').strip(),
+                recipient_data.get('TelegramID', '').strip()
+            )
+            if search_tuple:
+                field_name, value = search_tuple
+                ids_by_field[field_name].add(value)
+
+        user_map = {}
+        with SessionFactory() as session:
+            for field_name, ids in ids_by_field.items():
+                column = getattr(User, field_name)
+                ids = list(ids)
+                for start in range(0, len(ids), USER_LOOKUP_CHUNK):
+                    chunk = ids[start:start + USER_LOOKUP_CHUNK]
+                    for user in session.query(User).filter(column.in_(chunk)):
+                        user_map[(field_name, getattr(user, field_name))] = user
+            # Users outlive this session; workers attach them with merge(load=False)
+            # and reread notes before writing them
+            session.expunge_all()
+
+        logger.info(f"Resolved {len(user_map)} recipients in database")
+        return user_map
+
+    async def _prefetch_templates(self, langs: set):
+        """
+        Load broadcast templates once per language before processing recipients
+
+        Args:
+            langs: Languages of resolved recipients ('en' is always added)
+        """
+        new_langs = {lang for lang in langs | {'en'} if (BROADCAST_TEMPLATES[0], lang) not in self._template_cache}
+        for lang in new_langs:
+            for name in BROADCAST_TEMPLATES:
+                self._template_cache[(name, lang)] = await MessageTemplates.get_template(name, lang=lang)
+        if new_langs:
+            logger.info(f"Prefetched broadcast templates for languages: {sorted(new_langs)}")
+
+    async def _get_template(self, name: str, lang: str) -> Optional[Dict]:
+        """Get broadcast template from campaign cache (auto-fallback to English in get_template)"""
+        key = (name, lang)
+        if key not in self._template_cache:
+            self._template_cache[key] = await MessageTemplates.get_template(name, lang=lang)
+        return self._template_cache[key]
+
+    @staticmethod
+    @contextmanager
+    def _session_scope(session=None):
+        """Use provided session or open own one for the duration of the block"""
+        if session is not None:
+            yield session
+        else:
+            with SessionFactory() as own_session:
+                yield own_session
+
+    def _compile(self, text: str, fix_html: bool = False) -> _CompiledTemplate:
+        """Get compiled template for text (parsed once per campaign)"""
+        key = (text, fix_html)
+        compiled = self._compiled_templates.get(key)
+        if compiled is None:
+            compiled = _CompiledTemplate(text, self._fix_telegram_html if fix_html else None)
+            self._compiled_templates[key] = compiled
+        return compiled
+
     def _fix_telegram_html(self, text: str) -> str:
         """
         Replace <br> tags with newlines for Telegram HTML parser
@@ -257,14 +419,13 @@ class BroadcastManager:
                 text_template = template['text']
                 buttons = template['buttons']
 
-                # Format text with variables using SafeDict for safety
-                formatted_text = text_template.format_map(SafeDict(variables))
-                formatted_text = self._fix_telegram_html(formatted_text)  # Fix <br> tags
+                # Format text with variables using SafeDict for safety; <br> tags are fixed
+                formatted_text = self._compile(text_template, fix_html=True).render(variables)
 
                 # Format buttons if they exist
                 formatted_buttons = None
                 if buttons:
-                    formatted_buttons = buttons.format_map(SafeDict(variables))
+                    formatted_buttons = self._compile(buttons).render(variables)
 
                 # Create notification
                 notification = Notification(
@@ -323,15 +484,16 @@ class BroadcastManager:
             body_text = body_template['text']
 
             # Format templates with variables using SafeDict
-            subject = subject_text.format_map(SafeDict(variables))
-            body = body_text.format_map(SafeDict(variables))
-
-            # Send email
-            success = await email_manager.send_notification_email(
-                to=email,
-                subject=subject,
-                body=body
-            )
+            subject = self._compile(subject_text).render(variables)
+            body = self._compile(body_text).render(variables)
+
+            # Send email (rate limited across all workers)
+            async with self.email_limiter:
+                success = await email_manager.send_notification_email(
+                    to=email,
+                    subject=subject,
+                    body=body
+                )
 
             if success:
                 logger.info(f"Email sent to {email}")
@@ -344,20 +506,100 @@ class BroadcastManager:
             logger.error(f"Error sending email to {email}: {e}")
             return False
 
+    async def _deliver_bot(
+            self,
+            user: User,
+            user_lang: str,
+            session,
+            variables: Dict,
+            broker_code: str,
+            row_number: int,
+            result: Dict
+    ):
+        """Create bot notification and mark user in notes (updates result in place)"""
+        try:
+            # Get template for user's language (auto-fallback to English if not exists)
+            bot_template = await self._get_template('broadcast_bot', user_lang)
+
+            if not bot_template:
+                logger.error(f"Bot template not found for any language")
+                result['errors'].append("Bot template not found")
+                return
+
+            bot_success = await self.create_bot_notification(
+                user,
+                bot_template,
+                variables,
+                session=session
+            )
+            result['bot_sent'] = bot_success
+
+            if bot_success:
+                # Mark user as received DARWIN broadcast in notes.
+                # Preloaded user may be minutes old - reread notes so that
+                # set_user_note doesn't overwrite changes made since then
+                await asyncio.to_thread(session.refresh, user, ['notes'])
+                import helpers
+                helpers.set_user_note(user, 'dwBroadcast', '1')
+                if broker_code:
+                    helpers.set_user_note(user, 'dwBrokerCode', broker_code)
+                db_user_id = user.userID  # Read before commit expires the instance
+                await asyncio.to_thread(session.commit)
+                logger.info(f"Marked user {db_user_id} as received DARWIN broadcast with code {broker_code}")
+            else:
+                result['errors'].append(f"Failed to create bot notification")
+
+        except Exception as e:
+            logger.error(f"Error processing bot notification for row {row_number}: {e}")
+            result['errors'].append(f"Bot notification error: {str(e)}")
+            # Session may be shared with next recipients - drop half-done changes
+            session.rollback()
+
+    async def _deliver_email(self, email: str, user_lang: str, variables: Dict, row_number: int, result: Dict):
+        """Send broadcast email in user's language (updates result in place)"""
+        try:
+            # Get email templates for user's language (auto-fallback to English)
+            email_subject_template = await self._get_template('broadcast_email_subject', user_lang)
+            email_body_template = await self._get_template('broadcast_email_body', user_lang)
+
+            if not email_subject_template or not email_body_template:
+                logger.error(f"Email templates not found for language {user_lang}")
+                result['errors'].append("Email templates not found")
+                return
+
+            email_success = await self.send_email_notification(
+                email,
+                email_subject_template,
+                email_body_template,
+                variables
+            )
+            result['email_sent'] = email_success
+
+            if not email_success:
+                result['errors'].append(f"Failed to send email")
+
+        except Exception as e:
+            logger.error(f"Error processing email for row {row_number}: {e}")
+            result['errors'].append(f"Email error: {str(e)}")
+
     async def process_single_recipient(
             self,
             row_number: int,
             recipient_data: Dict,
-            skip_email: bool = False
+            skip_email: bool = False,
+            user_map: Optional[Dict[tuple, User]] = None,
+            session=None
     ) -> Dict:
         """
         Process single recipient - send to bot and/or email
-        Templates are loaded on-demand based on user's language
+        Templates are taken from the per-campaign cache by user's language
 
         Args:
             row_number: Row number in sheet (for error reporting)
             recipient_data: Dictionary with recipient data
             skip_email: If True, skip email sending
+            user_map: Users preloaded by _load_users (if None, user is queried)
+            session: Optional existing session (if None, creates own)
 
         Returns:
             Dictionary with processing results
@@ -393,84 +635,77 @@ class BroadcastManager:
         user = None
         user_lang = 'en'  # Default language
 
-        if search_tuple:
-            # Get user with active session
-            with SessionFactory() as session:
-                user = self._get_user_from_db(session, search_tuple)
-
-                if user:
-                    result['user_found'] = True
-                    # Use user's language from DB (auto-fallback to 'en' in get_template)
-                    user_lang = user.lang or 'en'
-                    logger.info(f"User {user.userID} language: {user_lang}")
-
-                    # Send bot notification
-                    try:
-                        # Get template for user's language (auto-fallback to English if not exists)
-                        bot_template = await MessageTemplates.get_template('broadcast_bot', lang=user_lang)
-
-                        if not bot_template:
-                            logger.error(f"Bot template not found for any language")
-                            result['errors'].append("Bot template not found")
-                        else:
-                            bot_success = await self.create_bot_notification(
-                                user,
-                                bot_template,
-                                variables,
-                                session=session
-                            )
-                            result['bot_sent'] = bot_success
-
-                            if bot_success:
-                                # Mark user as received DARWIN broadcast in notes
-                                import helpers
-                                helpers.set_user_note(user, 'dwBroadcast', '1')
-                                if broker_code:
-                                    helpers.set_user_note(user, 'dwBrokerCode', broker_code)
-                                session.commit()
-                                logger.info(f"Marked user {user.userID} as received DARWIN broadcast with code {broker_code}")
-                            else:
-                                result['errors'].append(f"Failed to create bot notification")
-
-                    except Exception as e:
-                        logger.error(f"Error processing bot notification for row {row_number}: {e}")
-                        result['errors'].append(f"Bot notification error: {str(e)}")
-
-        if not user:
-            # User not found in DB
-            result['errors'].append("User not found in database")
-            logger.warning(f"Row {row_number}: User not found - UserID: {user_id}, TelegramID: {telegram_id}")
-
-        # Send email if email address provided and not skipping emails
-        if email and not skip_email:
-            try:
-                # Get email templates for user's language (auto-fallback to English)
-                email_subject_template = await MessageTemplates.get_template('broadcast_email_subject', lang=user_lang)
-                email_body_template = await MessageTemplates.get_template('broadcast_email_body', lang=user_lang)
-
-                if not email_subject_template or not email_body_template:
-                    logger.error(f"Email templates not found for language {user_lang}")
-                    result['errors'].append("Email templates not found")
+        with self._session_scope(session) as session:
+            if search_tuple:
+                # Get user with active session
+                if user_map is not None:
+                    user = user_map.get(search_tuple)
+                    if user is not None:
+                        # Attach preloaded user to this session without another SELECT
+                        user = session.merge(user, load=False)
                 else:
-                    email_success = await self.send_email_notification(
-                        email,
-                        email_subject_template,
-                        email_body_template,
-                        variables
-                    )
-                    result['email_sent'] = email_success
-
-                    if not email_success:
-                        result['errors'].append(f"Failed to send email")
-
-            except Exception as e:
-                logger.error(f"Error processing email for row {row_number}: {e}")
-                result['errors'].append(f"Email error: {str(e)}")
-        elif email and skip_email:
-            logger.debug(f"Skipping email for row {row_number} due to --nomail flag")
+                    user = await asyncio.to_thread(self._get_user_from_db, session, search_tuple)
+
+            deliveries = []
+            if user:
+                result['user_found'] = True
+                # Use user's language from DB (auto-fallback to 'en' in get_template)
+                user_lang = user.lang or 'en'
+                logger.info(f"User {user.userID} language: {user_lang}")
+                deliveries.append(self._deliver_bot(user, user_lang, session, variables, broker_code, row_number, result))
+            else:
+                # User not found in DB
+                result['errors'].append("User not found in database")
+                logger.warning(f"Row {row_number}: User not found - UserID: {user_id}, TelegramID: {telegram_id}")
+
+            # Send email if email address provided and not skipping emails
+            if email and not skip_email:
+                deliveries.append(self._deliver_email(email, user_lang, variables, row_number, result))
+            elif email and skip_email:
+                logger.debug(f"Skipping email for row {row_number} due to --nomail flag")
+
+            # Bot notification (DB) and email (SMTP) target different systems - run them together
+            for outcome in await asyncio.gather(*deliveries, return_exceptions=True):
+                if isinstance(outcome, Exception):
+                    logger.error(f"Delivery error for row {row_number}: {outcome}")
+                    result['errors'].append(f"Delivery error: {str(outcome)}")
 
         return result
 
+    def _record_error(self, idx: int, recipient_data: Dict, errors: List[str]):
+        """Add failed row to campaign statistics"""
+        self.stats['error_count'] += 1
+        self.stats['error_samples'].append({
+            'row': idx + 1,
+            'user_id': recipient_data.get('UserID', ''),
+            'telegram_id': recipient_data.get('TelegramID', ''),
+            'email': recipient_data.get('Email', ''),
+            'errors': errors
+        })
+
+    def _record_result(self, idx: int, recipient_data: Dict, result: Dict, skip_email: bool):
+        """Update campaign statistics with single recipient result"""
+        has_email = bool(recipient_data.get('Email', '').strip())
+
+        if result['bot_sent']:
+            self.stats['bot_sent'] += 1
+        elif result['user_found']:
+            self.stats['bot_failed'] += 1
+
+        if skip_email and has_email:
+            self.stats['email_skipped'] += 1
+        elif result['email_sent']:
+            self.stats['email_sent'] += 1
+        elif has_email:
+            self.stats['email_failed'] += 1
+
+        if not result['user_found'] and not has_email:
+            self.stats['not_found_in_db'] += 1
+
+        # Record errors
+        if result['errors']:
+            self._record_error(idx, recipient_data, result['errors'])
+
     async def run_broadcast(
             self,
             sheet_url: str = BROADCAST_SHEET_URL,
@@ -511,99 +746,91 @@ class BroadcastManager:
                     raise Exception("Failed to initialize Google Services")
 
             # Reset statistics
-            self.stats = {
-                'total_recipients': 0,
-                'bot_sent': 0,
-                'bot_failed': 0,
-                'email_sent': 0,
-                'email_failed': 0,
-                'email_skipped': 0,
-                'not_found_in_db': 0,
-                'errors': []
-            }
-
-            # Load recipients
-            recipients = await self.read_recipients_from_sheet(sheet_url, test_mode)
-            if not recipients:
-                logger.error("No recipients found in sheet")
-                return self.stats
+            self.stats = self._empty_stats()
+
+            self._template_cache = {}
+            self._compiled_templates = {}
+            progress = {'processed': 0}
+
+            # Recipients are processed by a pool of workers fed from a queue:
+            # sends are I/O-bound, so wall time drops roughly by the pool size.
+            # The bounded queue keeps sheet reading at most one page ahead of sending
+            queue = asyncio.Queue(maxsize=SHEET_PAGE_ROWS)
+
+            async def worker():
+                # One session per worker instead of one per recipient. SQL runs in
+                # asyncio.to_thread so DB waits don't stall other workers; a session
+                # is only touched by its own worker, one call at a time
+                with SessionFactory() as session:
+                    await process_queue(session)
+
+            async def process_queue(session):
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        return
+
+                    # Check for cancellation; remaining rows are drained without processing
+                    if self.should_cancel:
+                        if not self.stats.get('cancelled'):
+                            logger.info(f"Broadcast cancelled by user at {progress['processed']}/{self.stats['total_recipients']}")
+                            self.stats['cancelled'] = True
+                            self.stats['cancelled_at'] = progress['processed']
+                        continue
 
-            self.stats['total_recipients'] = len(recipients)
-            logger.info(f"Processing {len(recipients)} recipients")
-            logger.info("Templates will be loaded per-user based on their language with auto-fallback to English")
+                    idx, recipient_data, user_map = item
 
-            # Process recipients in batches
-            email_batch = []
-            processed_count = 0
+                    try:
+                        # Process recipient with skip_email flag
+                        result = await self.process_single_recipient(
+                            row_number=idx + 1,  # +1 because of header row
+                            recipient_data=recipient_data,
+                            skip_email=skip_email,
+                            user_map=user_map,
+                            session=session
+                        )
+                        # Commit/rollback happens in _deliver_bot, the only writer
+                        self._record_result(idx, recipient_data, result, skip_email)
+
+                        progress['processed'] += 1
+
+                        # Send progress report
+                        if progress_callback and progress['processed'] % PROGRESS_REPORT_EVERY == 0:
+                            await progress_callback(progress['processed'], self._stats_snapshot())
 
-            for idx, recipient_data in enumerate(recipients, start=1):
-                # Check for cancellation
-                if self.should_cancel:
-                    logger.info(f"Broadcast cancelled by user at {processed_count}/{len(recipients)}")
-                    self.stats['cancelled'] = True
-                    self.stats['cancelled_at'] = processed_count
-                    break
+                    except Exception as e:
+                        logger.error(f"Error processing recipient {idx}: {e}")
+                        session.rollback()
+                        self._record_error(idx, recipient_data, [str(e)])
 
-                try:
-                    # Process recipient with skip_email flag
-                    result = await self.process_single_recipient(
-                        row_number=idx + 1,  # +1 because of header row
-                        recipient_data=recipient_data,
-                        skip_email=skip_email
-                    )
-
-                    # Update statistics
-                    if result['bot_sent']:
-                        self.stats['bot_sent'] += 1
-                    elif result['user_found']:
-                        self.stats['bot_failed'] += 1
-
-                    if skip_email and recipient_data.get('Email', '').strip():
-                        self.stats['email_skipped'] += 1
-                    elif result['email_sent']:
-                        self.stats['email_sent'] += 1
-                        email_batch.append(recipient_data.get('Email', ''))
-                    elif recipient_data.get('Email', '').strip():
-                        self.stats['email_failed'] += 1
-
-                    if not result['user_found'] and not recipient_data.get('Email', '').strip():
-                        self.stats['not_found_in_db'] += 1
-
-                    # Record errors
-                    if result['errors']:
-                        self.stats['errors'].append({
-                            'row': idx + 1,
-                            'user_id': recipient_data.get('UserID', ''),
-                            'telegram_id': recipient_data.get('TelegramID', ''),
-                            'email': recipient_data.get('Email', ''),
-                            'errors': result['errors']
-                        })
-
-                    processed_count += 1
-
-                    # Send progress report
-                    if progress_callback and processed_count % PROGRESS_REPORT_EVERY == 0:
-                        await progress_callback(processed_count, self.stats.copy())
-
-                    # Batch delay for emails (only if not skipping emails)
-                    if not skip_email and len(email_batch) >= BATCH_SIZE:
-                        logger.info(f"Processed batch of {len(email_batch)} emails, waiting {BATCH_DELAY}s...")
-                        await asyncio.sleep(BATCH_DELAY)
-                        email_batch = []
-
-                except Exception as e:
-                    logger.error(f"Error processing recipient {idx}: {e}")
-                    self.stats['errors'].append({
-                        'row': idx + 1,
-                        'user_id': recipient_data.get('UserID', ''),
-                        'telegram_id': recipient_data.get('TelegramID', ''),
-                        'email': recipient_data.get('Email', ''),
-                        'errors': [str(e)]
-                    })
-
-            # Final batch delay if any emails left
-            if not skip_email and email_batch:
-                await asyncio.sleep(BATCH_DELAY)
+            workers = [asyncio.create_task(worker()) for _ in range(BROADCAST_CONCURRENCY)]
+            try:
+                # Load recipients page by page and feed them to workers as they arrive
+                idx = 0
+                async for recipients in self.read_recipients_from_sheet(sheet_url, test_mode):
+                    if self.should_cancel:
+                        if not self.stats.get('cancelled'):
+                            logger.info(f"Broadcast cancelled by user at {progress['processed']}/{self.stats['total_recipients']}")
+                            self.stats['cancelled'] = True
+                            self.stats['cancelled_at'] = progress['processed']
+                        break
+
+                    self.stats['total_recipients'] += len(recipients)
+                    user_map = await asyncio.to_thread(self._load_users, recipients)
+                    await self._prefetch_templates({user.lang or 'en' for user in user_map.values()})
+                    logger.info(f"Queued {len(recipients)} recipients (total {self.stats['total_recipients']})")
+
+                    for recipient_data in recipients:
+                        idx += 1
+                        await queue.put((idx, recipient_data, user_map))
+            finally:
+                for _ in workers:
+                    await queue.put(None)  # One stop sentinel per worker
+                await asyncio.gather(*workers)
+
+            if not self.stats['total_recipients']:
+                logger.error("No recipients found in sheet")
+                return self.stats
 
             # Calculate duration
             duration = datetime.now() - start_time
@@ -660,9 +887,9 @@ class BroadcastManager:
             report += f"\n🔴 <b>Critical Error:</b>\n{stats['critical_error']}\n"
 
         # Add errors summary
-        if stats['errors']:
-            report += f"\n\n❌ <b>Errors ({len(stats['errors'])}):</b>\n"
-            for i, error in enumerate(stats['errors'][:10], 1):
+        if stats['error_count']:
+            report += f"\n\n❌ <b>Errors ({stats['error_count']}):</b>\n"
+            for i, error in enumerate(stats['error_samples'], 1):
                 report += f"\n{i}. Row {error['row']}"
                 if error.get('user_id'):
                     report += f" | UserID: {error['user_id']}"
@@ -672,8 +899,8 @@ class BroadcastManager:
                     report += f" | Email: {error['email'][:20]}..."
                 report += f"\n   {', '.join(error['errors'])}\n"
 
-            if len(stats['errors']) > 10:
-                report += f"\n... and {len(stats['errors']) - 10} more errors\n"
+            if stats['error_count'] > len(stats['error_samples']):
+                report += f"\n... and {stats['error_count'] - len(stats['error_samples'])} more errors\n"
 
         return report
 
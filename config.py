@@ -149,6 +149,7 @@ REQUIRED_CHANNELS = [
 BOOKSTACK_URL = os.getenv("BOOKSTACK_URL", "https://jetup.info")
 BOOKSTACK_TOKEN_ID = os.getenv("BOOKSTACK_TOKEN_ID")
 BOOKSTACK_TOKEN_SECRET = os.getenv("BOOKSTACK_TOKEN_SECRET")
+JINJA_CACHE_DIR = Path(os.getenv("JINJA_CACHE_DIR", "./cache/jinja"))  # Байткод шаблонов документов
 
 # Стандартные документы проектов
 PROJECT_DOCUMENTS = {
@@ -1,11 +1,23 @@
-from sqlalchemy import Column, Integer, String, Text, Float, DateTime, ForeignKey, Boolean, PrimaryKeyConstraint
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy import Column, Integer, String, Text, Float, DateTime, ForeignKey, Boolean, PrimaryKeyConstraint, Index, \
+    text
+from sqlalchemy.orm import relationship, backref, validates
 from sqlalchemy.ext.declarative import declarative_base
 import datetime
 from random import randint
 
 Base = declarative_base()
 
+PURCHASE_REASON_PREFIX = 'purchase='
+
+
+def parse_purchase_reason(reason: str):
+    """Возвращает ID покупки из reason вида 'purchase=<id>' или None"""
+    if reason and reason.startswith(PURCHASE_REASON_PREFIX):
+        purchase_id = reason[len(PURCHASE_REASON_PREFIX):]
+        if purchase_id.isdigit():
+            return int(purchase_id)
+    return None
+
 
 class User(Base):
     __tablename__ = 'users'
@@ -123,7 +135,7 @@ class Bonus(Base):
 
     userID = Column(Integer, ForeignKey('users.userID'), nullable=False)
     downlineID = Column(Integer, ForeignKey('users.userID'), nullable=True)  # Nullable для системных бонусов
-    purchaseID = Column(Integer, ForeignKey('purchases.purchaseID'), nullable=True)  # Опциональная связь
+    purchaseID = Column(Integer, ForeignKey('purchases.purchaseID', ondelete='CASCADE'), nullable=True)  # Опциональная связь
 
     projectID = Column(Integer, nullable=True)
     optionID = Column(Integer, nullable=True)
@@ -163,6 +175,11 @@ class Payment(Base):
 
     user = relationship('User', backref='payments')
 
+    __table_args__ = (
+        # Частичный индекс: платежи на проверке — малая часть таблицы
+        Index('ix_payments_check', 'paymentID', sqlite_where=text("status = 'check'")),
+    )
+
 
 class ActiveBalance(Base):
     __tablename__ = 'active_balance'
@@ -177,9 +194,21 @@ class ActiveBalance(Base):
     reason = Column(String, nullable=False)
     link = Column(String, nullable=True)
     notes = Column(Text, nullable=True)
+    purchaseID = Column(Integer, ForeignKey('purchases.purchaseID'), nullable=True, index=True)  # Из reason=purchase=<id>
 
     user = relationship('User', backref='active_balance_records')
 
+    __table_args__ = (
+        # История баланса: последние записи пользователя, фильтр по reason - остаточный
+        Index('ix_active_balance_user_created', 'userID', 'createdAt'),
+    )
+
+    @validates('reason')
+    def _sync_purchase_id(self, key, reason):
+        """Дублирует ID покупки из reason в индексируемую колонку purchaseID"""
+        self.purchaseID = parse_purchase_reason(reason)
+        return reason
+
 
 class PassiveBalance(Base):
     __tablename__ = 'passive_balance'
@@ -197,6 +226,10 @@ class PassiveBalance(Base):
 
     user = relationship('User', backref='passive_balance_records')
 
+    __table_args__ = (
+        Index('ix_passive_balance_user_created', 'userID', 'createdAt'),
+    )
+
 
 class Transfer(Base):
     __tablename__ = 'transfers'
@@ -245,7 +278,7 @@ class Notification(Base):
     parent_id = Column(Integer, ForeignKey('notifications.notificationID'), nullable=True)
     thread_id = Column(String, nullable=True)  # Для группировки связанных уведомлений
     related_entity_type = Column(String, nullable=True)
-    related_entity_id = Column(Integer, nullable=True)
+    related_entity_id = Column(Integer, nullable=True, index=True)
 
     deliveries = relationship("NotificationDelivery", backref="notification")
 
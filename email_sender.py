@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import aiosmtplib
 from typing import Dict, Any, Optional
@@ -251,7 +252,8 @@ class EmailManager:
 
     def __init__(self):
         self.providers = {}  # Changed from list to dict for named providers
-        self.secure_domains = []  # List of domains that should use Mailgun
+        self.secure_domains = frozenset()  # Domains that should use Mailgun
+        self.secure_domains_joined = ''  # Same domains as a display string
 
         # Load secure domains from config
         self._load_secure_domains()
@@ -298,15 +300,21 @@ class EmailManager:
                 # Parse domains, remove spaces, ensure @ prefix
                 domains = [d.strip() for d in domains_str.split(',') if d.strip()]
                 # Ensure all domains start with @
-                self.secure_domains = [d if d.startswith('@') else f'@{d}' for d in domains]
-                logger.info(f"Loaded secure domains: {self.secure_domains}")
+                domains = [d if d.startswith('@') else f'@{d}' for d in domains]
+                self._set_secure_domains(domains)
+                logger.info(f"Loaded secure domains: {self.secure_domains_joined}")
             else:
-                self.secure_domains = []
+                self._set_secure_domains([])
                 logger.info("No secure domains configured")
 
         except Exception as e:
             logger.warning(f"Could not load secure domains: {e}")
-            self.secure_domains = []
+            self._set_secure_domains([])
+
+    def _set_secure_domains(self, domains: List[str]):
+        """Store secure domains as a set for lookups plus a joined string for display"""
+        self.secure_domains = frozenset(domains)
+        self.secure_domains_joined = ', '.join(dict.fromkeys(domains))
 
     def _get_email_domain(self, email: str) -> str:
         """Extract domain from email address"""
@@ -497,20 +505,23 @@ class EmailManager:
         Returns:
             Dict[str, bool]: Dictionary provider -> status
         """
-        status = {}
-
-        for provider_name, provider in self.providers.items():
-            try:
-                if hasattr(provider, 'test_connection'):
-                    status[provider_name] = await provider.test_connection()
-                else:
-                    # For providers without test_connection method
-                    status[provider_name] = False
-
-            except Exception:
-                status[provider_name] = False
-
-        return status
+        async def probe(provider) -> bool:
+            # For providers without test_connection method
+            if not hasattr(provider, 'test_connection'):
+                return False
+            return await provider.test_connection()
+
+        # Probe all providers concurrently: total wait is the slowest probe, not the sum
+        names = list(self.providers)
+        results = await asyncio.gather(
+            *(probe(self.providers[name]) for name in names),
+            return_exceptions=True
+        )
+
+        return {
+            name: result if isinstance(result, bool) else False
+            for name, result in zip(names, results)
+        }
 
     def reload_secure_domains(self):
         """Reload secure domains configuration (called after &upconfig)"""
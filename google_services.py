@@ -1,4 +1,5 @@
 import re
+import time
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
@@ -6,14 +7,26 @@ import gspread
 from config import GOOGLE_CREDENTIALS_JSON, SCOPES
 
 
+SERVICES_CACHE_TTL = 3600  # секунд до пересоздания клиентов
+
+_services_cache = {'ts': 0.0, 'clients': None}
+
+
 def get_google_services():
     """
     Возвращает сервисы для работы с Google Sheets и Google Drive API.
+
+    Клиенты переиспользуются в течение SERVICES_CACHE_TTL секунд, чтобы
+    не проходить авторизацию и TLS-рукопожатие на каждый вызов.
     """
-    creds = Credentials.from_service_account_file(GOOGLE_CREDENTIALS_JSON, scopes=SCOPES)
-    sheets_client = gspread.authorize(creds)
-    drive_service = build("drive", "v3", credentials=creds, cache_discovery=False)
-    return sheets_client, drive_service
+    now = time.monotonic()
+    if _services_cache['clients'] is None or now - _services_cache['ts'] > SERVICES_CACHE_TTL:
+        creds = Credentials.from_service_account_file(GOOGLE_CREDENTIALS_JSON, scopes=SCOPES)
+        sheets_client = gspread.authorize(creds)
+        drive_service = build("drive", "v3", credentials=creds, cache_discovery=False)
+        _services_cache['clients'] = (sheets_client, drive_service)
+        _services_cache['ts'] = now
+    return _services_cache['clients']
 
 
 def extract_file_id(url):
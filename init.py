@@ -1,12 +1,38 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from database import Base
 import config
 
+# Пул соединений общий для всех фабрик сессий процесса
+POOL_SIZE = 10
+POOL_MAX_OVERFLOW = 20
+
+_engine = None
+
+
+def get_engine():
+    """Возвращает общий для процесса движок с пулом соединений
+
+    Для файловой SQLite SQLAlchemy 1.4 по умолчанию использует NullPool и
+    открывает файл БД заново на каждую сессию, поэтому пул задается явно.
+    """
+    global _engine
+    if _engine is None:
+        _engine = create_engine(
+            config.DATABASE_URL,
+            connect_args={"check_same_thread": False},
+            poolclass=QueuePool,
+            pool_size=POOL_SIZE,
+            max_overflow=POOL_MAX_OVERFLOW,
+            pool_pre_ping=True
+        )
+    return _engine
+
 
 def get_session():
     """Создает и возвращает фабрику сессий SQLAlchemy и движок базы данных"""
-    engine = create_engine(config.DATABASE_URL, connect_args={"check_same_thread": False})
+    engine = get_engine()
     session_factory = sessionmaker(bind=engine)
     return session_factory, engine
 
@@ -14,7 +40,58 @@ def get_session():
 def init_tables(engine):
     """Инициализирует таблицы базы данных"""
     Base.metadata.create_all(engine)
+    upgrade_schema(engine)
+
+
+def upgrade_schema(engine):
+    """Досоздает колонки и индексы, добавленные в модели после создания таблиц
+
+    create_all() не изменяет существующие таблицы, поэтому новые колонки
+    добавляются здесь и заполняются из уже имеющихся данных.
+    """
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+
+    with engine.begin() as conn:
+        if 'payments' in tables:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_payments_check ON payments (paymentID) WHERE status = 'check'"
+            ))
+
+        if 'notifications' in tables:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_notifications_related_entity_id "
+                "ON notifications (related_entity_id)"
+            ))
+
+        # История баланса выбирает последние записи пользователя с фильтром reason LIKE '<тип>=%';
+        # индекс (userID, createdAt) отдает их уже отсортированными
+        for balance_table in ('active_balance', 'passive_balance'):
+            if balance_table in tables:
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{balance_table}_user_created "
+                    f"ON {balance_table} (userID, createdAt)"
+                ))
+
+        if 'active_balance' not in tables:
+            return
+
+        columns = {column['name'] for column in inspector.get_columns('active_balance')}
+        if 'purchaseID' not in columns:
+            conn.execute(text("ALTER TABLE active_balance ADD COLUMN purchaseID INTEGER"))
+
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_active_balance_purchaseID ON active_balance (purchaseID)"
+        ))
+
+        # Переносим ID покупки из reason='purchase=<id>' для старых записей;
+        # как и parse_purchase_reason, пропускаем reason с нецифровым хвостом (purchase=12abc)
+        conn.execute(text(
+            "UPDATE active_balance SET purchaseID = CAST(SUBSTR(reason, 10) AS INTEGER) "
+            "WHERE purchaseID IS NULL AND reason GLOB 'purchase=[0-9]*' "
+            "AND reason NOT GLOB 'purchase=*[^0-9]*'"
+        ))
 
 
 # Для обратной совместимости с существующим кодом
-Session, _engine = get_session()
+Session, engine = get_session()
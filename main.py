@@ -301,11 +301,12 @@ async def generate_document(
             logger.info(f"Starting {document_type} generation for {id_value}")
 
             # Получаем HTML из BookStack
-            from bookstack_integration import get_document_html, render_document, get_document_as_pdf
+            from bookstack_integration import get_document_html, render_document, get_document_as_pdf_async
             import io
 
-            # Получаем HTML документа
-            html = get_document_html(project, doc_type)
+            # BookStack (requests) и wkhtmltopdf блокирующие - выполняем их в потоках,
+            # чтобы генерация документа не останавливала обработку других апдейтов
+            html = await asyncio.to_thread(get_document_html, project, doc_type)
             if not html:
                 logger.error(f"No HTML content found for project {project.projectID}")
                 raise FileNotFoundError(f"Template not found for {document_type} {id_value}")
@@ -313,11 +314,11 @@ async def generate_document(
             logger.info(f"Got HTML content, length: {len(html)}")
 
             # Рендерим шаблон
-            rendered_html = render_document(html, context)
+            rendered_html = await asyncio.to_thread(render_document, html, context)
             logger.info(f"Rendered HTML, length: {len(rendered_html)}")
 
-            # Генерируем PDF
-            pdf_bytes = get_document_as_pdf(rendered_html)
+            # Генерируем PDF (пул ограничивает число одновременных wkhtmltopdf)
+            pdf_bytes = await get_document_as_pdf_async(rendered_html)
             if not pdf_bytes:
                 logger.error("Failed to get PDF bytes")
                 raise RuntimeError("PDF generation failed")
@@ -1076,6 +1077,31 @@ async def confirm_transfer(callback_query: types.CallbackQuery, state: FSMContex
             if source_balance == "passive" and sender_db.balancePassive < amount:
                 raise ValueError("Недостаточно средств на пассивном балансе")
 
+            # Текст уведомления получателю готовим до первой записи в БД,
+            # чтобы не держать блокировку на запись во время await
+            notify_recipient = sender.userID != recipient_id
+            if notify_recipient:
+                # Маскируем имя отправителя для безопасности (импортируем mask_name из transfer_manager)
+                from transfer_manager import mask_name
+                masked_first_name = mask_name(sender_db.firstname)
+                masked_surname = mask_name(sender_db.surname) if sender_db.surname else ""
+                masked_sender_name = f"{masked_first_name} {masked_surname}".strip()
+
+                extra_bonus_text = ""
+                if source_balance == 'passive':
+                    extra_bonus_text = f"+{config.TRANSFER_BONUS}%"
+
+                notification_text, notification_buttons = await MessageTemplates.get_raw_template(
+                    'transfer_received_notification',
+                    {
+                        'sender_name': masked_sender_name,
+                        'sender_id': sender.userID,
+                        'amount': recipient_amount,
+                        'extra_bonus_text': extra_bonus_text  # Передаем уже подготовленный текст
+                    },
+                    lang=recipient.lang  # Используем язык получателя для локализации
+                )
+
             transfer = Transfer(
                 senderUserID=sender.userID,
                 senderFirstname=sender_db.firstname,
@@ -1135,32 +1161,11 @@ async def confirm_transfer(callback_query: types.CallbackQuery, state: FSMContex
             session.add(recipient_record)
 
             # Если получатель - это другой пользователь, отправляем ему уведомление
-            if sender.userID != recipient_id:
-                # Маскируем имя отправителя для безопасности (импортируем mask_name из transfer_manager)
-                from transfer_manager import mask_name
-                masked_first_name = mask_name(sender_db.firstname)
-                masked_surname = mask_name(sender_db.surname) if sender_db.surname else ""
-                masked_sender_name = f"{masked_first_name} {masked_surname}".strip()
-
-                extra_bonus_text = ""
-                if source_balance == 'passive':
-                    extra_bonus_text = f"+{config.TRANSFER_BONUS}%"
-
-                text, buttons = await MessageTemplates.get_raw_template(
-                    'transfer_received_notification',
-                    {
-                        'sender_name': masked_sender_name,
-                        'sender_id': sender.userID,
-                        'amount': recipient_amount,
-                        'extra_bonus_text': extra_bonus_text  # Передаем уже подготовленный текст
-                    },
-                    lang=recipient.lang  # Используем язык получателя для локализации
-                )
-
+            if notify_recipient:
                 notification = Notification(
                     source="transfer",
-                    text=text,
-                    buttons=buttons,  # Добавляем кнопки из шаблона
+                    text=notification_text,
+                    buttons=notification_buttons,  # Добавляем кнопки из шаблона
                     target_type="user",
                     target_value=str(recipient_id),
                     priority=2,
@@ -2146,43 +2151,56 @@ async def create_user_payment_notification(payment: Payment, payer: User, is_app
     )
 
 
-async def create_payment_check_notification(payment: Payment, user: User) -> None:
-    """Creates notification for admins about new payment."""
-    with Session() as session:
-        if not config.ADMIN_USER_IDS:
-            logging.error("No admin users found in database!")
-            raise ValueError("No admin users found in database!")
+async def create_payment_check_notification(payment: Payment, user: User, session=None) -> None:
+    """Creates notification for admins about new payment.
 
-        text, buttons = await MessageTemplates.get_raw_template(
-            'admin_new_payment_notification',
-            {
-                'user_name': user.firstname,
-                'user_id': user.userID,
-                'payment_id': payment.paymentID,
-                'payment_date': payment.createdAt,
-                'amount': payment.amount,
-                'method': payment.method,
-                'sum_currency': payment.sumCurrency,
-                'txid': payment.txid,
-                'wallet': payment.toWallet,
-                'tx_browser_url': config.TX_BROWSERS[payment.method]
-            }
-        )
+    If session is given, the rows join the caller's transaction and the caller commits.
+    """
+    if not config.ADMIN_USER_IDS:
+        logging.error("No admin users found in database!")
+        raise ValueError("No admin users found in database!")
 
-        for admin_id in config.ADMIN_USER_IDS:
-            notification = Notification(
-                source="payment_checker",
-                text=text,  # Теперь используем text из кортежа
-                buttons=buttons,  # И buttons из кортежа
-                target_type="user",
-                target_value=str(admin_id),
-                priority=2,
-                parse_mode="HTML",
-                category="payment",
-                importance="high"
-            )
-            session.add(notification)
+    # Шаблон готовим до открытия транзакции
+    text, buttons = await MessageTemplates.get_raw_template(
+        'admin_new_payment_notification',
+        {
+            'user_name': user.firstname,
+            'user_id': user.userID,
+            'payment_id': payment.paymentID,
+            'payment_date': payment.createdAt,
+            'amount': payment.amount,
+            'method': payment.method,
+            'sum_currency': payment.sumCurrency,
+            'txid': payment.txid,
+            'wallet': payment.toWallet,
+            'tx_browser_url': config.TX_BROWSERS[payment.method]
+        }
+    )
+
+    # Одно уведомление на админа, вставляются одним executemany
+    notifications = [
+        {
+            "source": "payment_checker",
+            "text": text,
+            "buttons": buttons,
+            "target_type": "user",
+            "target_value": str(admin_id),
+            "priority": 2,
+            "parse_mode": "HTML",
+            "category": "payment",
+            "importance": "high",
+            "related_entity_type": "payment",
+            "related_entity_id": payment.paymentID
+        }
+        for admin_id in config.ADMIN_USER_IDS
+    ]
 
+    if session is not None:
+        session.execute(Notification.__table__.insert(), notifications)
+        return
+
+    with Session() as session:
+        session.execute(Notification.__table__.insert(), notifications)
         session.commit()
 
 
@@ -3,7 +3,8 @@
 ActiveBalance model - tracks all active balance transactions.
 """
 from sqlalchemy import Column, Integer, String, DECIMAL, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
+from database import parse_purchase_reason
 from models.base import Base, AuditMixin
 
 
@@ -26,6 +27,8 @@ class ActiveBalance(Base, AuditMixin):
 
     # Transaction metadata
     reason = Column(String, nullable=True)  # payment=123, transfer=456, purchase=789
+    purchaseID = Column(Integer, ForeignKey('purchases.purchaseID'), nullable=True,
+                        index=True)  # Дубль ID из reason=purchase=<id> для поиска по индексу
     link = Column(String, nullable=True)  # Ссылка на связанную транзакцию
     notes = Column(String, nullable=True)  # Дополнительные заметки
 
@@ -34,5 +37,11 @@ class ActiveBalance(Base, AuditMixin):
     # Relationships
     user = relationship('User', backref='active_balance_transactions')
 
+    @validates('reason')
+    def _sync_purchase_id(self, key, reason):
+        """Дублирует ID покупки из reason в индексируемую колонку purchaseID"""
+        self.purchaseID = parse_purchase_reason(reason)
+        return reason
+
     def __repr__(self):
         return f"<ActiveBalance(id={self.activeBalanceID}, user={self.userID}, amount={self.amount})>"
\ No newline at end of file
@@ -17,7 +17,8 @@ class Bonus(Base, AuditMixin):
     userID = Column(Integer, ForeignKey('users.userID'), nullable=False)  # Кто получает бонус
     downlineID = Column(Integer, ForeignKey('users.userID'),
                         nullable=True)  # От кого (может быть null для системных бонусов)
-    purchaseID = Column(Integer, ForeignKey('purchases.purchaseID'), nullable=True)  # За какую покупку
+    purchaseID = Column(Integer, ForeignKey('purchases.purchaseID', ondelete='CASCADE'),
+                        nullable=True)  # За какую покупку
 
     # Denormalized data for reports
     projectID = Column(Integer, nullable=True)
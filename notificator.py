@@ -13,6 +13,8 @@ from config import API_TOKEN
 
 logger = logging.getLogger(__name__)
 
+DELIVERY_BATCH_SIZE = 500  # доставок на одну пакетную вставку
+
 
 class SafeDict(dict):
     def __missing__(self, key):
@@ -186,14 +188,19 @@ class NotificationProcessor:
                     session.add(delivery)
 
                 elif notification.target_type == "all":
-                    users = session.query(User.userID).all()
-                    deliveries = [
-                        NotificationDelivery(
+                    # Читаем пользователей потоком и пишем доставки пачками,
+                    # чтобы память не росла вместе с таблицей users
+                    deliveries = []
+                    for user in session.query(User.userID).yield_per(DELIVERY_BATCH_SIZE):
+                        deliveries.append(NotificationDelivery(
                             notificationID=notification.notificationID,
                             userID=user.userID
-                        ) for user in users
-                    ]
-                    session.bulk_save_objects(deliveries)
+                        ))
+                        if len(deliveries) >= DELIVERY_BATCH_SIZE:
+                            session.bulk_save_objects(deliveries)
+                            deliveries = []
+                    if deliveries:
+                        session.bulk_save_objects(deliveries)
 
                 elif notification.target_type == "filter":
                     user_ids = await self.process_filter(notification.target_value)
@@ -10,6 +10,8 @@ from datetime import datetime
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 
+from gspread.utils import absolute_range_name, fill_gaps, numericise_all
+
 from google_services import get_google_services
 from sync_system.sync_config import (
     SYNC_CONFIG,
@@ -21,6 +23,29 @@ import config
 logger = logging.getLogger(__name__)
 
 
+def fetch_sheets_records(sheet_names: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Загружает строки нескольких листов одним запросом values_batch_get
+
+    Возвращает {sheet_name: records} в том же виде, что и worksheet.get_all_records()
+    """
+    sheets_client, _ = get_google_services()
+    spreadsheet = sheets_client.open_by_key(config.GOOGLE_SHEET_ID)
+    response = spreadsheet.values_batch_get([absolute_range_name(name) for name in sheet_names])
+
+    records = {}
+    for sheet_name, value_range in zip(sheet_names, response.get('valueRanges', [])):
+        data = fill_gaps(value_range.get('values', []))
+        if not data:
+            records[sheet_name] = []
+            continue
+
+        keys = data[0]
+        records[sheet_name] = [dict(zip(keys, numericise_all(row))) for row in data[1:]]
+
+    return records
+
+
 class UniversalSyncEngine:
     """Универсальный движок для синхронизации любой таблицы"""
 
@@ -77,13 +102,16 @@ class UniversalSyncEngine:
                 'table': self.table_name
             }
 
-    def import_from_sheets(self, session: Session, dry_run: bool = False) -> Dict[str, Any]:
+    def import_from_sheets(self, session: Session, dry_run: bool = False,
+                           raw_records: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         """
         Импортирует данные из Google Sheets в БД
 
         Args:
             session: SQLAlchemy сессия
             dry_run: Если True, только показывает что изменится, не применяет
+            raw_records: Заранее загруженные строки листа (см. fetch_sheets_records);
+                если не переданы, лист читается отдельным запросом
         """
         results = {
             'table': self.table_name,
@@ -97,13 +125,14 @@ class UniversalSyncEngine:
         }
 
         try:
-            # Подключаемся к Google Sheets
-            sheets_client, _ = get_google_services()
-            spreadsheet = sheets_client.open_by_key(config.GOOGLE_SHEET_ID)
-            sheet = spreadsheet.worksheet(self.sheet_name)
+            if raw_records is None:
+                # Подключаемся к Google Sheets
+                sheets_client, _ = get_google_services()
+                spreadsheet = sheets_client.open_by_key(config.GOOGLE_SHEET_ID)
+                sheet = spreadsheet.worksheet(self.sheet_name)
 
-            # Получаем сырые данные
-            raw_records = sheet.get_all_records()
+                # Получаем сырые данные
+                raw_records = sheet.get_all_records()
 
             # ОЧИСТКА ДАННЫХ ИЗ GOOGLE SHEETS
             sheet_records = []
@@ -128,6 +157,9 @@ class UniversalSyncEngine:
 
             results['total'] = len(sheet_records)
 
+            # Существующие записи одним запросом вместо SELECT на каждую строку
+            existing_records = self._load_existing_records(session)
+
             # Переменные для отслеживания повторяющихся ошибок
             consecutive_errors = 0
             last_error = ""
@@ -157,7 +189,7 @@ class UniversalSyncEngine:
                                 # Ищем существующую запись для проверки
                                 primary_value = row.get('telegramID')
                                 if primary_value:
-                                    existing = session.query(self.model).filter_by(telegramID=primary_value).first()
+                                    existing = existing_records.get(self._record_key(primary_value))
                                     if existing:
                                         db_value = float(getattr(existing, field, 0))
                                         # Сравниваем с точностью до 2 знаков
@@ -181,7 +213,7 @@ class UniversalSyncEngine:
                         continue
 
                     # Обрабатываем строку
-                    result = self._process_row(session, row, row_idx, dry_run)
+                    result = self._process_row(session, row, row_idx, dry_run, existing_records)
 
                     # Обрабатываем результат
                     if result['action'] == 'update':
@@ -224,6 +256,9 @@ class UniversalSyncEngine:
                             from init import Session
                             session = Session()
 
+                        # Откат отменил добавленные записи, перечитываем индекс
+                        existing_records = self._load_existing_records(session)
+
                     logger.error(f"Error processing row {row_idx}: {error_msg}")
                     results['errors'].append({
                         'row': row_idx,
@@ -268,27 +303,38 @@ class UniversalSyncEngine:
 
         return results
 
-    def _process_row(self, session: Session, row: Dict, row_idx: int, dry_run: bool) -> Dict:
+    @property
+    def _lookup_field(self) -> str:
+        """Поле, по которому строка листа сопоставляется с записью в БД"""
+        # Для Users ищем по telegramID, а не по userID!
+        return 'telegramID' if self.table_name == 'Users' else self.primary_key
+
+    @staticmethod
+    def _record_key(value: Any) -> Any:
+        """Приводит ключ из листа к типу ключа в БД (числовые ID могут прийти строкой)"""
+        if isinstance(value, str) and value.lstrip('-').isdigit():
+            return int(value)
+        return value
+
+    def _load_existing_records(self, session: Session) -> Dict[Any, Any]:
+        """Загружает все записи таблицы в словарь {ключ сопоставления: запись}"""
+        lookup_field = self._lookup_field
+        return {
+            getattr(record, lookup_field): record
+            for record in session.query(self.model)
+        }
+
+    def _process_row(self, session: Session, row: Dict, row_idx: int, dry_run: bool,
+                     existing_records: Dict[Any, Any]) -> Dict:
         """Обрабатывает одну строку из Google Sheets"""
 
         try:
-            if self.table_name == 'Users':
-                # Для Users ищем по telegramID, а не по userID!
-                telegram_id = row.get('telegramID')
-                if not telegram_id:
-                    return {'action': 'skip'}
-
-                # Ищем существующего пользователя по telegramID
-                record = session.query(self.model).filter_by(telegramID=telegram_id).first()
-            else:
-                # Для остальных таблиц используем primary_key
-                record_id = row.get(self.primary_key)
-                if not record_id:
-                    return {'action': 'skip'}
+            record_key = row.get(self._lookup_field)
+            if not record_key:
+                return {'action': 'skip'}
 
-                record = session.query(self.model).filter(
-                    getattr(self.model, self.primary_key) == record_id
-                ).first()
+            record_key = self._record_key(record_key)
+            record = existing_records.get(record_key)
 
             if record:
                 # Обновляем существующую запись
@@ -299,7 +345,11 @@ class UniversalSyncEngine:
                     return {'action': 'skip'}
             else:
                 # Создаем новую запись
-                if self._create_record(session, row, row_idx, dry_run):
+                record = self._create_record(session, row, row_idx, dry_run)
+                if record is not None:
+                    # Повторная строка с тем же ключом обновит добавленную запись
+                    if not dry_run:
+                        existing_records[record_key] = record
                     return {'action': 'add'}
                 else:
                     return {'action': 'skip'}
@@ -394,28 +444,23 @@ class UniversalSyncEngine:
 
         return changes
 
-    def _create_record(self, session: Session, row: Dict, row_idx: int, dry_run: bool) -> bool:
-        """Создает новую запись"""
+    def _create_record(self, session: Session, row: Dict, row_idx: int, dry_run: bool) -> Optional[Any]:
+        """
+        Создает новую запись
+
+        Returns:
+            Добавленную запись (в dry_run - несохраненную модель) или None, если строка пропущена.
+            Дубликат ключа сюда не попадает: _process_row уже проверил его по индексу записей
+        """
 
         # Проверяем required fields
         for field in self.config['required_fields']:
             if field not in row or not row[field]:
                 logger.warning(f"Row {row_idx}: Missing required field: {field}")
-                return False
-
-        # Для Users проверяем дубликат telegramID
-        if self.table_name == 'Users':
-            telegram_id = row.get('telegramID')
-            existing = session.query(self.model).filter_by(telegramID=telegram_id).first()
-            if existing:
-                logger.error(
-                    f"Row {row_idx}: telegramID {telegram_id} already exists "
-                    f"with userID={existing.userID}, cannot add new userID={row.get('userID')}"
-                )
-                return False
+                return None
 
         if dry_run:
-            return True
+            return self.model()
 
         record = self.model()
 
@@ -451,7 +496,7 @@ class UniversalSyncEngine:
             setattr(record, field_name, converted_value)
 
         session.add(record)
-        return True
+        return record
 
     def _convert_value(self, field_name: str, value: Any) -> Any:
         """
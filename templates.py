@@ -34,9 +34,11 @@ class MessageTemplates:
         sheet = sheets_client.open_by_key(GOOGLE_SHEET_ID).worksheet("Templates")
         rows = sheet.get_all_records()
 
+        # displayText - текст с уже раскрытыми '\\n', чтобы не делать replace на каждый рендер
         MessageTemplates._cache = {
             (row['stateKey'], row['lang']): {
                 'text': row['text'],
+                'displayText': str(row['text']).replace('\\n', '\n'),
                 'parseMode': row['parseMode'],
                 'disablePreview': row['disablePreview'],
                 'mediaType': row['mediaType'],
@@ -79,7 +81,7 @@ class MessageTemplates:
             if not template:
                 raise ValueError(f"Template not found: {state_key}")
 
-        text = template['text'].replace('\\n', '\n')
+        text = template['displayText']
         buttons = template['buttons']
 
         if 'rgroup' in variables:
@@ -364,7 +366,7 @@ class MessageTemplates:
             format_vars = (variables or {}).copy()  # Безопасная инициализация и копирование
 
             for template in templates:
-                text = template['text'].replace('\\n', '\n')
+                text = template['displayText']
 
                 if 'rgroup' in format_vars:
                     text = cls.process_repeating_group(text, format_vars['rgroup'])